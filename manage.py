@@ -6,10 +6,38 @@ import os
 def run_unit_tests() -> str:
     parser = argparse.ArgumentParser()
 
+    parser.add_argument('command')
+    parser.add_argument('--q', required=True)
+    parser.add_argument('--workers', type=int, default=0)
+
+    args, extra_params = parser.parse_known_args()
+    if args.workers > 1:
+        return "pipenv run python -m pg.testrunner --workers {} " \
+            "/flask-examples/{} -s {}".format(
+                args.workers, args.q, ' '.join(extra_params))
+    return "pipenv run pytest -s -q /flask-examples/{} {}".format(
+        args.q, ' '.join(extra_params))
+
+def run_benchmark() -> str:
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('command')
     parser.add_argument('--q', required=True)
 
     args, extra_params = parser.parse_known_args()
-    return "pipenv run pytest -s -q /flask-examples/{}".format(args.q)
+    return "pipenv run python /flask-examples/src/benchmarks/{} {}".format(
+        args.q, ' '.join(extra_params))
+
+
+def calibrate_bcrypt() -> str:
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('command')
+
+    args, extra_params = parser.parse_known_args()
+    return "cd /flask-examples/src; pipenv run python -m pg.calibrate {}"\
+        .format(' '.join(extra_params))
+
 
 def connect_pg() -> str:
     return '/usr/bin/pg_ctl  restart; psql'
@@ -25,6 +53,8 @@ def main():
 
     command_options = {
         'test': {'cmd': run_unit_tests, 'image': 'python'},
+        'bench': {'cmd': run_benchmark, 'image': 'python'},
+        'calibrate_bcrypt': {'cmd': calibrate_bcrypt, 'image': 'python'},
         'connect_pg': {'cmd': connect_pg, 'image': 'postgresql'}
     }
 
@@ -1,4 +1,3 @@
-from authlib.integrations.flask_oauth2 import AuthorizationServer
 from flask import Flask, current_app
 
 
@@ -24,6 +23,7 @@ def get_or_create_app(name: str, routes: typing.Tuple = tuple()) -> Flask:
 
         if 'FLASK' not in prefixes:
             prefixes.add('FLASK')
+        prefixes = tuple(p for p in prefixes if p)
 
         if 'FLASK_TESTING' not in os.environ:
             os.environ['FLASK_TESTING'] = 'False'
@@ -31,10 +31,8 @@ def get_or_create_app(name: str, routes: typing.Tuple = tuple()) -> Flask:
         if 'FLASK_LOG_LEVEL' not in os.environ:
             os.environ['FLASK_LOG_LEVEL'] = 'INFO'
 
-        for k in os.environ.keys():
-            for prefix in prefixes:
-                if prefix in k:
-                    app.config[k] = os.environ[k]
+        app.config.update(
+            (k, v) for k, v in os.environ.items() if k.startswith(prefixes))
 
     def init_routing(app: Flask) -> None:
         """Looks for the environment variable FLASK_BH_ROUTES it's default
@@ -0,0 +1,77 @@
+"""
+Serialization throughput of typical API payloads with the previous
+flask.json + custom_converter path and every available json backend
+
+Usage:
+    python benchmarks/bench_json.py [n_iterations]
+"""
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from flask import json
+from serializers import encoders
+
+import sys
+import time
+import uuid
+
+
+def custom_converter(o):
+    # previous JsonSerializer.custom_converter
+    if type(o) is uuid.UUID:
+        return str(o)
+    elif type(o) is date:
+        return o.isoformat()
+    elif type(o) is datetime:
+        return o.astimezone().isoformat()
+
+
+def user(x):
+    return {
+        'id': x,
+        'key': uuid.uuid4(),
+        'username': 'user{}@example.com'.format(x),
+        'is_active': x % 2 == 0,
+        'credit_score': Decimal('{}.25'.format(x)),
+        'birthday': date(1980, 1, 1 + x % 28),
+        'created_at': datetime.now(timezone.utc),
+        'updated_at': datetime.now(timezone.utc),
+    }
+
+
+PAYLOADS = {
+    'single object': user(1),
+    'page of 100': {'items': [user(x) for x in range(100)], 'next': None},
+    'page of 1000': {'items': [user(x) for x in range(1000)], 'next': None},
+}
+
+
+def throughput(func, payload, n_iterations):
+    func(payload)
+    start = time.perf_counter()
+    for x in range(n_iterations):
+        func(payload)
+    return n_iterations / (time.perf_counter() - start)
+
+
+def main():
+    n_iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    encoders_to_test = [(
+        'flask.json indent=4',
+        lambda p: json.dumps(p, default=custom_converter, indent=4))]
+    for name in sorted(encoders.BACKENDS):
+        try:
+            backend = encoders.set_backend(name)
+        except ValueError:
+            continue
+        encoders_to_test.append((name, backend.dumpb))
+
+    for payload_name, payload in PAYLOADS.items():
+        print(payload_name)
+        for name, func in encoders_to_test:
+            print('    {:22} {:12.0f} payloads/s'.format(
+                name, throughput(func, payload, n_iterations)))
+
+
+if __name__ == '__main__':
+    main()
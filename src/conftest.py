@@ -0,0 +1,4 @@
+# tests run on an empty database without cleandb, see pg.testing
+from pg.testing import (  # noqa: F401
+    pg_isolation, pytest_addoption, pytest_configure,
+    pytest_terminal_summary)
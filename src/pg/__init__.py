@@ -1,7 +1,12 @@
-from pg.connection import ConnectionPool
+from pg.connection import ConnectionPool, RoutingSession, as_bool
+from pg.instrumentation import init_instrumentation
+from pg.parallel import run_parallel
+from pg import hashing, slowlog
 from flask import _app_ctx_stack
 from flask import current_app
 
+import functools
+
 class PGSqlAlchemy(object):
     def __init__(self, app):
         self.app = app
@@ -12,37 +17,69 @@ class PGSqlAlchemy(object):
 
         self.pool = ConnectionPool(scopefunc=_app_ctx_stack)
 
-    def syncdb(self):
+    def syncdb(self, timeout=None):
         from pg.orm import BaseModel
         """
-        Create tables if they don't exist
+        Create tables if they don't exist, every connection is synced
+        concurrently
         """
-        for conn_name, conn in self.pool.connections.items():
-            BaseModel.metadata.create_all(conn.engine)
-
+        run_parallel({
+            conn_name: functools.partial(
+                BaseModel.metadata.create_all, conn.engine)
+            for conn_name, conn in self.pool.connections.items()
+        }, timeout=timeout)
 
-    def cleandb(self):
+    def cleandb(self, timeout=None):
         from pg.orm import BaseModel
-        for t in reversed(BaseModel.metadata.sorted_tables):
-            sql = 'delete from {} cascade;'.format(t.name)
-            for conn_name, conn in self.pool.connections.items():
-                conn.session.execute(sql)
-                conn.session.commit()
+        """
+        Deletes every row, connections are cleaned concurrently in a
+        single transaction each
+        """
+        isolation = RoutingSession.isolation
+        if isolation is not None and isolation.cleandb(self.pool.connections):
+            # the test has not used the database yet, see pg.testing
+            return
+
+        statements = [
+            'delete from {} cascade;'.format(t.name)
+            for t in reversed(BaseModel.metadata.sorted_tables)
+        ]
+
+        def clean(session):
+            for sql in statements:
+                session.execute(sql)
+            session.commit()
+
+        # sessions are scoped to the calling thread, they are resolved
+        # here and handed to the workers
+        run_parallel({
+            conn_name: functools.partial(clean, conn.session())
+            for conn_name, conn in self.pool.connections.items()
+        }, timeout=timeout)
 
 
 def init_db(app):
     ctx = _app_ctx_stack.top
     db = PGSqlAlchemy(app)
+    hashing.configure_from_app(app)
+    slowlog.configure_from_app(app)
     ctx.pg_sqlalchemy = db
 
+    if as_bool(app.config.get('PG_INSTRUMENT')):
+        init_instrumentation(app)
+    deferred_flush = as_bool(app.config.get('PG_DEFERRED_FLUSH'))
+
     @app.before_request
     def before_request():
         """
         Assign postgresql connection pool to the global
-        flask object at the beginning of every request
+        flask object at the beginning of every request, engines are
+        borrowed from the process wide registry so nothing is rebuilt here
         """
         ctx = _app_ctx_stack.top
         ctx.pg_sqlalchemy = PGSqlAlchemy(current_app._get_current_object())
+        # add, update and delete are flushed together, see pg.batch
+        ctx.pg_deferred_flush = deferred_flush
 
     @app.teardown_request
     def teardown_request(exception):
@@ -53,6 +90,16 @@ def init_db(app):
         ctx = _app_ctx_stack.top
         db = getattr(ctx, 'pg_sqlalchemy', None)
         if db is not None:
-            for k, v in db.pool.connections.items():
+            for k, v in db.pool.connections.opened().items():
+                v.session.remove()
+
+    @app.teardown_appcontext
+    def teardown_appcontext(exception):
+        """
+        Sessions opened outside of a request (scripts, unit tests) give
+        their connections back when the application context ends
+        """
+        for k, v in db.pool.connections.opened().items():
+            if v.session.registry.has():
                 v.session.remove()
     return db
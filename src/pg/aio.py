@@ -0,0 +1,245 @@
+from flask import current_app
+from sqlalchemy import bindparam, func, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from pg.connection import engine_options, parse_connections
+from pg.pagination import parse_order_by
+from pg.statements import (
+    LIMIT, OFFSET, criteria, filter_shape, parameters, statement_cache)
+
+import asyncio
+import threading
+
+
+ASYNC_DRIVER = 'postgresql+asyncpg'
+
+
+def async_url(connection_string):
+    """
+    Same database as connection_string, through the asyncpg driver
+    """
+    return make_url(connection_string).set(drivername=ASYNC_DRIVER)
+
+
+class AsyncConnection(object):
+    def __init__(
+            self, engine, sessionmaker, connection_string, options, loop):
+        self.engine = engine
+        self.sessionmaker = sessionmaker
+        self.connection_string = connection_string
+        self.options = options
+        self.loop = loop
+        # disposes the engine when it is cancelled, asyncio.run cancels
+        # the pending tasks before closing the loop
+        self.closing = loop.create_task(self._dispose_on_cancel())
+
+    async def _dispose_on_cancel(self):
+        try:
+            await self.loop.create_future()
+        finally:
+            await self.engine.dispose()
+
+    def close(self):
+        """
+        Disposes the engine on its own loop, the asyncpg connections can
+        not be closed from another one
+        """
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.closing.cancel)
+
+
+class AsyncEngineRegistry(object):
+    """
+    Process wide registry of asyncio engines, built from the same
+    SQLALCHEMY_* configuration values as the sync engines with a pool of
+    their own per connection name. asyncpg connections belong to an event
+    loop, engines are rebuilt when they are used from a different loop and
+    disposed when their loop ends or another loop replaces them
+    """
+    def __init__(self):
+        self.connections = {}
+        self._config = {}
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        self._config = parse_connections(config)
+
+    def get(self, connection_name='SQLALCHEMY_DEFAULT'):
+        loop = asyncio.get_running_loop()
+        conn = self.connections.get(connection_name)
+        if conn is not None and conn.loop is loop:
+            return conn
+
+        with self._lock:
+            conn = self.connections.get(connection_name)
+            if conn is not None and conn.loop is loop:
+                return conn
+
+            if connection_name not in self._config:
+                self.configure(current_app.config)
+            connection_string, options = self._config[connection_name]
+
+            url = async_url(connection_string)
+            if options.get('PREPARED_STATEMENT_CACHE_SIZE'):
+                # prepared statements kept per asyncpg connection
+                url = url.update_query_dict({
+                    'prepared_statement_cache_size':
+                        options['PREPARED_STATEMENT_CACHE_SIZE']})
+            engine = create_async_engine(url, **engine_options(options))
+            conn = AsyncConnection(
+                engine,
+                sessionmaker(
+                    engine, class_=AsyncSession, expire_on_commit=False),
+                connection_string, options, loop)
+            previous = self.connections.get(connection_name)
+            if previous is not None:
+                previous.close()
+            self.connections[connection_name] = conn
+            return conn
+
+    async def dispose(self):
+        """
+        Closes the pooled connections of the running loop
+        """
+        loop = asyncio.get_running_loop()
+        for name, conn in list(self.connections.items()):
+            if conn.loop is loop:
+                del self.connections[name]
+                conn.closing.cancel()
+                await asyncio.gather(conn.closing, return_exceptions=True)
+
+
+registry = AsyncEngineRegistry()
+
+
+class AsyncBaseManager(object):
+    """
+    asyncio counterpart of BaseManager, available on every model as
+    async_objects. There is no request scoped session: every call uses
+    its own AsyncSession and writes are committed before returning
+    """
+    def __init__(self, model, registry=registry):
+        self._model = model
+        self._registry = registry
+
+    def session(self, connection_name='SQLALCHEMY_DEFAULT'):
+        return self._registry.get(connection_name).sessionmaker()
+
+    def _order_by(self, order_by):
+        return [
+            column.desc() if descending else column.asc()
+            for name, column, descending in parse_order_by(
+                self._model, order_by)
+        ]
+
+    def _select(self, order_by, **kwargs):
+        return select(self._model).filter_by(**kwargs).order_by(
+            *self._order_by(order_by))
+
+    def _statement(self, method, connection_name, shape, build, *extra):
+        """
+        Cached statement of a filter shape, asyncpg prepares statements on
+        the server and reuses them while the SQL text stays the same
+        """
+        return statement_cache.get(
+            (self._model, 'async_' + method, shape, connection_name) + extra,
+            build)
+
+    async def get(self, connection_name='SQLALCHEMY_DEFAULT', **kwargs):
+        if not kwargs:
+            raise Exception(
+                "Can not execute a query without parameters")
+
+        shape = filter_shape(self._model, kwargs)
+        if shape is None:
+            statement, values = select(self._model).filter_by(
+                **kwargs).limit(1), {}
+        else:
+            statement = self._statement(
+                'get', connection_name, shape,
+                lambda: select(self._model).where(
+                    *criteria(self._model, shape)).limit(1))
+            values = parameters(kwargs)
+
+        async with self.session(connection_name) as session:
+            result = await session.execute(statement, values)
+            obj = result.scalars().first()
+
+        if obj is None:
+            raise Exception('Object not found')
+        return obj
+
+    async def filter_by(
+        self, order_by='id', limit=500, offset=0,
+            connection_name='SQLALCHEMY_DEFAULT', **kwargs):
+        """
+        Returns a list, same arguments as BaseManager.filter_by
+        """
+        shape = filter_shape(self._model, kwargs)
+        if shape is None:
+            statement, values = self._select(order_by, **kwargs).limit(
+                limit).offset(offset), {}
+        else:
+            statement = self._statement(
+                'filter_by', connection_name, shape,
+                lambda: select(self._model).where(
+                    *criteria(self._model, shape)).order_by(
+                        *self._order_by(order_by)).limit(
+                            bindparam(LIMIT)).offset(bindparam(OFFSET)),
+                order_by)
+            values = parameters(kwargs, **{LIMIT: limit, OFFSET: offset})
+
+        async with self.session(connection_name) as session:
+            result = await session.execute(statement, values)
+            return result.scalars().all()
+
+    async def count(self, connection_name='SQLALCHEMY_DEFAULT', **kwargs):
+        shape = filter_shape(self._model, kwargs)
+        if shape is None:
+            statement, values = select(func.count(self._model.id)).filter_by(
+                **kwargs), {}
+        else:
+            statement = self._statement(
+                'count', connection_name, shape,
+                lambda: select(func.count(self._model.id)).where(
+                    *criteria(self._model, shape)))
+            values = parameters(kwargs)
+
+        async with self.session(connection_name) as session:
+            result = await session.execute(statement, values)
+            return result.scalar() or 0
+
+    async def raw_sql(
+            self, sql, connection_name='SQLALCHEMY_DEFAULT', **kwargs):
+        """
+        Returns the fetched rows, or the number of affected rows for
+        statements that don't return rows
+        """
+        async with self.session(connection_name) as session:
+            async with session.begin():
+                result = await session.execute(text(sql), kwargs)
+                if result.returns_rows:
+                    return result.fetchall()
+                return result.rowcount
+
+    async def add_all(self, data, connection_name='SQLALCHEMY_DEFAULT'):
+        async with self.session(connection_name) as session:
+            async with session.begin():
+                session.add_all(data)
+        return data
+
+    async def stream(
+        self, fetch_size=1000, order_by='id',
+            connection_name='SQLALCHEMY_DEFAULT', **kwargs):
+        """
+        Async iterator over every matching row, rows are fetched from a
+        server side cursor fetch_size at a time
+        """
+        statement = self._select(order_by, **kwargs).execution_options(
+            yield_per=fetch_size)
+        async with self.session(connection_name) as session:
+            result = await session.stream(statement)
+            async for obj in result.scalars():
+                yield obj
@@ -0,0 +1,144 @@
+from flask import _app_ctx_stack
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class Batch(object):
+    """
+    Deferred flush of BaseModel.add, update and delete on a set of
+    sessions. Changes are queued in the session and written by a single
+    flush, where SQLAlchemy groups them by table: one multi row INSERT
+    ... RETURNING id (primary keys are filled in), one executemany UPDATE
+    and one executemany DELETE per table and set of columns
+
+    queued: statements the operations would have issued one by one
+    statements: statements issued by the flushes of the batch
+    saved: queued - statements
+
+    When the block raises, the changes it queued and did not flush yet
+    are discarded: added objects are expunged, deleted ones are restored
+    and updated ones are expired
+    """
+    def __init__(self, sessions):
+        self.sessions = list(sessions)
+        self.queued = 0
+        self.statements = 0
+        self.flushes = 0
+        self._previous = []
+        self._changes = []
+
+    @property
+    def saved(self):
+        return max(0, self.queued - self.statements)
+
+    def attach(self):
+        self._previous = [s.info.get('pg_batch') for s in self.sessions]
+        for session in self.sessions:
+            session.info['pg_batch'] = self
+
+    def detach(self):
+        for session, previous in zip(self.sessions, self._previous):
+            if previous is None:
+                session.info.pop('pg_batch', None)
+            else:
+                session.info['pg_batch'] = previous
+
+    def add(self, session, obj):
+        session.add(obj)
+        self._changes.append((session, obj))
+        self.queued += 1
+
+    def update(self, session, obj):
+        if session.is_modified(obj):
+            self._changes.append((session, obj))
+            self.queued += 1
+
+    def delete(self, session, obj):
+        if obj in session.new:
+            # added and deleted in the same batch, neither is written
+            session.expunge(obj)
+            self.queued += 1
+            return
+        session.delete(obj)
+        self._changes.append((session, obj))
+        self.queued += 1
+
+    def flush(self):
+        for session in self.sessions:
+            session.flush()
+
+    def flushed(self, session):
+        self._changes = [
+            (s, obj) for s, obj in self._changes if s is not session]
+
+    def discard(self):
+        """
+        Drops the queued changes that were not flushed
+        """
+        for session, obj in reversed(self._changes):
+            if obj in session.new:
+                session.expunge(obj)
+            elif obj in session.deleted:
+                session.add(obj)
+            elif obj in session.dirty:
+                session.expire(obj)
+        self._changes = []
+
+    def count_statement(
+            self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+
+    def __enter__(self):
+        self.attach()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+            else:
+                self.discard()
+        finally:
+            self.detach()
+
+
+def current_batch(session):
+    """
+    Batch of the session, requests of applications with PG_DEFERRED_FLUSH
+    get one the first time they write
+    """
+    batch = session.info.get('pg_batch')
+    if batch is None and getattr(
+            _app_ctx_stack.top, 'pg_deferred_flush', False):
+        # flushed by autoflush or at commit, dropped with the session
+        batch = Batch([session])
+        batch.attach()
+    return batch
+
+
+def _stop_counting(session):
+    counting = session.info.pop('pg_batch_counting', None)
+    if counting is not None and event.contains(
+            counting[0], 'before_cursor_execute', counting[1]):
+        event.remove(counting[0], 'before_cursor_execute', counting[1])
+
+
+@event.listens_for(Session, 'before_flush')
+def start_counting(session, flush_context, instances):
+    batch = session.info.get('pg_batch')
+    if batch is None:
+        return
+    # left over by a flush that failed
+    _stop_counting(session)
+    batch.flushes += 1
+    connection = session.connection()
+    event.listen(connection, 'before_cursor_execute', batch.count_statement)
+    session.info['pg_batch_counting'] = (connection, batch.count_statement)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def stop_counting(session, flush_context):
+    _stop_counting(session)
+    batch = session.info.get('pg_batch')
+    if batch is not None:
+        batch.flushed(session)
@@ -0,0 +1,267 @@
+from datetime import date, datetime, time
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+import io
+
+
+def batches(rows, batch_size):
+    """
+    Splits an iterable into lists of batch_size elements
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def row_values(row):
+    """
+    Returns a dictionary with the column values of a model instance, plain
+    dictionaries are returned unchanged
+    """
+    if isinstance(row, dict):
+        return row
+    return {
+        k: v for k, v in row.__dict__.items() if not k.startswith('_')
+    }
+
+
+class RowNormalizer(object):
+    """
+    Completes every row with the same set of columns, missing values are
+    filled with the column defaults. SQL expression defaults such as
+    pg.schema.utcnow are evaluated once, in a single round trip
+    """
+    def __init__(self, table, connection, first_row):
+        first_row = row_values(first_row)
+        self.table = table
+        self.columns = [
+            c for c in table.columns
+            if not (c.primary_key and c.key not in first_row)
+        ]
+        self.defaults = {}
+
+        clause_defaults = []
+        for c in self.columns:
+            if c.default is None:
+                continue
+            if c.default.is_clause_element:
+                clause_defaults.append(c.default.arg.label(c.key))
+            else:
+                self.defaults[c.key] = c.default.arg
+
+        if clause_defaults:
+            values = connection.execute(select(*clause_defaults)).first()
+            self.defaults.update(dict(values._mapping))
+
+    def default(self, key):
+        value = self.defaults.get(key)
+        if callable(value):
+            # callable column defaults are wrapped to receive a context
+            return value(None)
+        return value
+
+    def __call__(self, row):
+        row = row_values(row)
+        return {
+            c.key: row[c.key] if c.key in row else self.default(c.key)
+            for c in self.columns
+        }
+
+
+def _copy_escape(value):
+    if value is None:
+        return '\\N'
+    elif value is True:
+        return 't'
+    elif value is False:
+        return 'f'
+    elif isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\\\x' + bytes(value).hex()
+    return str(value).replace(
+        '\\', '\\\\').replace(
+        '\t', '\\t').replace(
+        '\n', '\\n').replace(
+        '\r', '\\r')
+
+
+class CopyReader(io.TextIOBase):
+    """
+    File like object that renders rows in COPY text format lazily, so the
+    whole data set is never held in memory
+    """
+    def __init__(self, rows, columns, dialect):
+        self._lines = self._render(rows, columns, dialect)
+        self._buffer = ''
+        self.rowcount = 0
+
+    def _render(self, rows, columns, dialect):
+        processors = [
+            c.type.dialect_impl(dialect).bind_processor(dialect)
+            for c in columns
+        ]
+        keys = [c.key for c in columns]
+
+        for row in rows:
+            values = []
+            for key, processor in zip(keys, processors):
+                value = row[key]
+                if processor is not None:
+                    value = processor(value)
+                values.append(_copy_escape(value))
+            self.rowcount += 1
+            yield '\t'.join(values) + '\n'
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def supports_copy(connection):
+    cursor = connection.connection.cursor()
+    try:
+        return hasattr(cursor, 'copy_expert')
+    finally:
+        cursor.close()
+
+
+def copy_rows(connection, table, columns, rows):
+    """
+    Streams rows through COPY ... FROM STDIN, returns the number of
+    inserted rows
+    """
+    reader = CopyReader(rows, columns, connection.dialect)
+    preparer = connection.dialect.identifier_preparer
+    sql = 'COPY {} ({}) FROM STDIN'.format(
+        preparer.format_table(table),
+        ', '.join(preparer.format_column(c) for c in columns))
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(sql, reader)
+    finally:
+        cursor.close()
+    return reader.rowcount
+
+
+def insert_rows(connection, table, rows, batch_size, returning=None):
+    """
+    Sends rows in batches of batch_size through a single cached INSERT
+    statement, psycopg2 renders every batch as a multi row VALUES clause.
+    When returning is a list of columns their values are returned in the
+    same order as rows
+    """
+    statement = table.insert()
+    if returning:
+        statement = statement.returning(*returning)
+
+    result = []
+    count = 0
+    for batch in batches(rows, batch_size):
+        if returning:
+            result.extend(connection.execute(statement, batch).fetchall())
+        else:
+            connection.execute(statement, batch)
+        count += len(batch)
+    return result if returning else count
+
+
+def upsert_rows(
+        connection, table, rows, conflict_columns, update_columns,
+        batch_size):
+    """
+    Multi row INSERT ... ON CONFLICT statements of batch_size rows.
+    Conflicting rows are updated with the values of update_columns and the
+    column onupdate expressions (updated_at), or left untouched when
+    update_columns is empty. Rows with a NULL key are always inserted, as
+    postgres does. Returns the ids in the same order as rows
+    """
+    keys = [table.c[name] for name in conflict_columns]
+
+    def upsert_statement(batch):
+        statement = insert(table).values(batch)
+        if update_columns:
+            values = {
+                name: statement.excluded[name] for name in update_columns}
+            for c in table.columns:
+                if c.onupdate is not None and c.key not in values:
+                    values[c.key] = c.onupdate.arg
+            statement = statement.on_conflict_do_update(
+                index_elements=keys, set_=values)
+        else:
+            statement = statement.on_conflict_do_nothing(
+                index_elements=keys)
+        return statement.returning(table.c.id, *keys)
+
+    processors = [
+        c.type.dialect_impl(connection.dialect).bind_processor(
+            connection.dialect)
+        for c in keys
+    ]
+
+    def row_key(values):
+        return tuple(
+            str(processor(v) if processor is not None else v)
+            for processor, v in zip(processors, values))
+
+    ordered_keys = []
+    key_values = {}
+    ids = {}
+    for batch in batches(rows, batch_size):
+        # postgres can not update the same row twice in one statement,
+        # the last occurrence of a key wins
+        unique = {}
+        nulls = []
+        for row in batch:
+            values = tuple(row[name] for name in conflict_columns)
+            if any(v is None for v in values):
+                # NULLs never conflict, every one of these rows is inserted
+                key = (None, len(ordered_keys))
+                ordered_keys.append(key)
+                nulls.append((key, row))
+                continue
+            key = row_key(values)
+            ordered_keys.append(key)
+            key_values[key] = values
+            unique[key] = row
+
+        if unique:
+            statement = upsert_statement(list(unique.values()))
+            for r in connection.execute(statement):
+                ids[row_key(r[1:])] = r[0]
+        if nulls:
+            # RETURNING follows the order of the VALUES list
+            statement = insert(table).values(
+                [row for key, row in nulls]).returning(table.c.id)
+            for (key, row), r in zip(nulls, connection.execute(statement)):
+                ids[key] = r[0]
+
+    # rows skipped by DO NOTHING do not show up in RETURNING
+    missing = [values for key, values in key_values.items() if key not in ids]
+    for batch in batches(missing, batch_size):
+        query = select(table.c.id, *keys).where(tuple_(*keys).in_(batch))
+        for r in connection.execute(query):
+            ids[row_key(r[1:])] = r[0]
+
+    return [ids.get(key) for key in ordered_keys]
@@ -0,0 +1,136 @@
+from collections import OrderedDict
+
+import threading
+import time
+
+
+def freeze(value):
+    """
+    Hashable form of a filter value, dictionaries (JSONB) and lists
+    (ARRAY) become tagged tuples. Lists keep their order
+    """
+    if isinstance(value, dict):
+        return (dict, tuple(sorted(
+            (k, freeze(v)) for k, v in value.items())))
+    elif isinstance(value, (list, tuple)):
+        return (list, tuple(freeze(v) for v in value))
+    elif isinstance(value, (set, frozenset)):
+        return frozenset(freeze(v) for v in value)
+    return value
+
+
+def filters_key(filters):
+    """
+    Cache key of keyword filters, None when a value can not be hashed
+    """
+    try:
+        key = freeze(filters)
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class TTLCache(object):
+    """
+    Thread safe dictionary whose entries expire after ttl seconds
+    """
+    def __init__(self, clock=time.monotonic):
+        self._data = {}
+        self._lock = threading.Lock()
+        self._clock = clock
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+
+        expires, value = entry
+        if expires < self._clock():
+            with self._lock:
+                self._data.pop(key, None)
+            return default
+        return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (self._clock() + ttl, value)
+
+    def invalidate(self, match=None):
+        """
+        Removes every entry, or the entries whose key satisfies match
+        """
+        with self._lock:
+            if match is None:
+                self._data.clear()
+            else:
+                for key in [k for k in self._data if match(k)]:
+                    del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LRUCache(object):
+    """
+    Bounded cache, least recently used entries are evicted once max_size
+    is reached and entries expire after ttl seconds. Keeps hit, miss and
+    eviction counters to help sizing it
+    """
+    def __init__(self, max_size=1000, ttl=60, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._clock = clock
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires >= self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (self._clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, match=None):
+        """
+        Removes every entry, or the entries whose key satisfies match
+        """
+        with self._lock:
+            if match is None:
+                self._data.clear()
+            else:
+                for key in [k for k in self._data if match(k)]:
+                    del self._data[key]
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'max_size': self.max_size,
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+
+# exact counts cached by (connection name, table name, filters)
+count_cache = TTLCache()
@@ -0,0 +1,61 @@
+"""
+Benchmarks bcrypt on the current machine and recommends the cost (rounds)
+for a target verification latency
+
+Usage:
+    python -m pg.calibrate --target-ms 250
+"""
+import argparse
+import bcrypt
+import time
+
+
+def measure(rounds, samples=3):
+    """
+    Returns the median time in seconds of a bcrypt verification with the
+    given cost
+    """
+    hashed = bcrypt.hashpw(b'calibration', bcrypt.gensalt(rounds))
+    timings = []
+    for x in range(samples):
+        start = time.perf_counter()
+        bcrypt.checkpw(b'calibration', hashed)
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def calibrate(target_ms=250, min_rounds=4, max_rounds=16, samples=3):
+    """
+    Returns (recommended rounds, {rounds: seconds}). The recommendation is
+    the highest cost whose verification stays under target_ms, every extra
+    round doubles the cost so measuring stops once the target is exceeded
+    """
+    timings = {}
+    recommended = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        timings[rounds] = measure(rounds, samples)
+        if timings[rounds] * 1000 > target_ms:
+            break
+        recommended = rounds
+    return recommended, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--target-ms', type=float, default=250)
+    parser.add_argument('--min-rounds', type=int, default=4)
+    parser.add_argument('--max-rounds', type=int, default=16)
+    parser.add_argument('--samples', type=int, default=3)
+    args = parser.parse_args()
+
+    recommended, timings = calibrate(
+        args.target_ms, args.min_rounds, args.max_rounds, args.samples)
+
+    for rounds, seconds in timings.items():
+        print('rounds {:2d}: {:10.1f} ms'.format(rounds, seconds * 1000))
+    print('recommended rounds for {} ms: {}'.format(
+        args.target_ms, recommended))
+
+
+if __name__ == '__main__':
+    main()
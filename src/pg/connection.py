@@ -1,65 +1,551 @@
 from flask import current_app
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
+from sqlalchemy.sql.expression import Select, TextClause
+
+from pg import metrics
+from pg.instrumentation import InstrumentedQueuePool, instrument_engine
+from pg.parallel import run_parallel
+from pg.statements import Explain
+
+import collections.abc
+import functools
+import itertools
+import re
+import threading
+import time
+
+
+# Per connection engine settings are declared next to the connection
+# string using a double underscore separator, for example:
+# SQLALCHEMY_DEFAULT__POOL_SIZE=20
+OPTIONS_SEPARATOR = '__'
+
+
+def as_bool(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+ENGINE_OPTIONS = {
+    'POOL_SIZE': ('pool_size', int),
+    'MAX_OVERFLOW': ('max_overflow', int),
+    'POOL_RECYCLE': ('pool_recycle', int),
+    'POOL_TIMEOUT': ('pool_timeout', int),
+    'POOL_PRE_PING': ('pool_pre_ping', as_bool),
+}
+
+
+# {database name: database name} replacements applied to the connection
+# strings, pg.testing points every worker of a parallel test run
+# (pg.testrunner) to databases of its own
+database_map = {}
+
+
+def map_database(connection_string):
+    if not database_map:
+        return connection_string
+    url = make_url(connection_string)
+    if url.database not in database_map:
+        return connection_string
+    return url.set(database=database_map[url.database]).render_as_string(
+        hide_password=False)
+
+
+def parse_connections(config, prefix='SQLALCHEMY'):
+    """
+    Returns a dictionary {connection_name: (connection_string, options)}
+    built from the configuration values that start with prefix
+    """
+    connections = {}
+    options = {}
+
+    for k, v in config.items():
+        if not k.startswith(prefix):
+            continue
+        if OPTIONS_SEPARATOR in k:
+            name, option = k.split(OPTIONS_SEPARATOR, 1)
+            options.setdefault(name, {})[option] = v
+        else:
+            connections[k] = map_database(v)
+
+    return {
+        name: (connection_string, options.get(name, {}))
+        for name, connection_string in connections.items()
+    }
+
+
+def replica_options(options):
+    """
+    Returns the replica connection strings and the ReplicaSet keyword
+    arguments declared in the options of a connection
+    """
+    replicas = [
+        map_database(r.strip())
+        for r in options.get('REPLICAS', '').split(',') if r.strip()
+    ]
+    kwargs = {'policy': options.get('REPLICA_POLICY', ROUND_ROBIN)}
+    if options.get('MAX_REPLICA_LAG'):
+        kwargs['max_lag'] = float(options['MAX_REPLICA_LAG'])
+    if options.get('REPLICA_LAG_CHECK_INTERVAL'):
+        kwargs['check_interval'] = float(
+            options['REPLICA_LAG_CHECK_INTERVAL'])
+    return replicas, kwargs
+
+
+def engine_options(options):
+    """
+    Translates connection options into create_engine keyword arguments
+    """
+    kwargs = {}
+    for option, value in options.items():
+        if option in ENGINE_OPTIONS:
+            arg_name, convert = ENGINE_OPTIONS[option]
+            kwargs[arg_name] = convert(value)
+    return kwargs
 
 
 class Connection(object):
-    def __init__(self, engine, session):
+    def __init__(
+            self, engine, session, connection_string=None, options=None,
+            replicas=None):
         """
         Encapsulates  an engine and session to a database
         """
         self.engine = engine
         self.session = session
+        self.connection_string = connection_string
+        self.options = options or {}
+        self.replicas = replicas
 
 
-class ConnectionPool:
+ROUND_ROBIN = 'round_robin'
+LEAST_LOADED = 'least_loaded'
+
+
+class Replica(object):
+    def __init__(self, engine, connection_string):
+        """
+        A read only copy of a database
+        """
+        self.engine = engine
+        self.connection_string = connection_string
+        self.lag = 0.0
+        self.lag_checked_at = None
+        self.reads = 0
+
+
+class ReplicaSet(object):
     """
-    Multiple postgresql database connections support
+    Replicas of a primary database, reads are spread round robin or to the
+    replica with fewer checked out connections. Replicas whose replication
+    lag is over max_lag seconds are left out of the rotation, the lag is
+    checked at most once every check_interval seconds by one thread at a
+    time, the others go on with the lag of the previous check
     """
-    connections = {}
+    LAG_SQL = """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery()
+                OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+            THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END
+    """
+
+    def __init__(
+            self, replicas, policy=ROUND_ROBIN, max_lag=None,
+            check_interval=5, clock=time.monotonic):
+        if policy not in (ROUND_ROBIN, LEAST_LOADED):
+            raise ValueError('Unknown replica policy {}'.format(policy))
+        self.replicas = replicas
+        self.policy = policy
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._counter = itertools.count()
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def check_lag(self, replica):
+        try:
+            with replica.engine.connect() as connection:
+                lag = connection.execute(text(self.LAG_SQL)).scalar()
+            replica.lag = float(lag or 0)
+        except Exception:
+            # unreachable replicas are out of the rotation until next check
+            replica.lag = float('inf')
+        replica.lag_checked_at = self._clock()
+
+    def available(self):
+        if self.max_lag is None:
+            return self.replicas
+
+        stale = self._stale()
+        # waits for the check only when a replica was never checked
+        if stale and self._lock.acquire(blocking=any(
+                r.lag_checked_at is None for r in stale)):
+            try:
+                for replica in self._stale():
+                    self.check_lag(replica)
+            finally:
+                self._lock.release()
+        return [r for r in self.replicas if r.lag <= self.max_lag]
+
+    def _stale(self):
+        now = self._clock()
+        return [
+            r for r in self.replicas
+            if r.lag_checked_at is None
+            or now - r.lag_checked_at >= self.check_interval]
+
+    def choose(self):
+        """
+        Returns a replica or None when every replica is out of rotation
+        """
+        replicas = self.available()
+        if not replicas:
+            return None
+        if self.policy == LEAST_LOADED:
+            return min(replicas, key=lambda r: r.engine.pool.checkedout())
+        return replicas[next(self._counter) % len(replicas)]
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+
 
-    def __init__(self, scopefunc=None):
+def rollback_prepared(engine, xid):
+    """
+    Runs ROLLBACK PREPARED on a connection of its own, it can not run in a
+    transaction block
+    """
+    with engine.connect() as connection:
+        connection.execution_options(
+            isolation_level='AUTOCOMMIT').exec_driver_sql(
+                "ROLLBACK PREPARED '{}'".format(xid))
+
+
+_LOCKING = re.compile(
+    r'\bFOR\s+(UPDATE|SHARE|NO\s+KEY\s+UPDATE|KEY\s+SHARE)\b', re.IGNORECASE)
+
+
+def is_read(clause):
+    """
+    Statements that can go to a replica. A SELECT text may lock rows or
+    call functions that write, it is only a read when the caller says so
+    with the pg_replica execution option (raw_sql(..., replica=True)).
+    EXPLAIN is a read when the statement it explains is
+    """
+    if isinstance(clause, Select):
+        return clause._for_update_arg is None
+    elif isinstance(clause, Explain):
+        return is_read(clause.statement)
+    elif isinstance(clause, TextClause):
+        return clause.get_execution_options().get('pg_replica', False) \
+            and clause.text.lstrip().upper().startswith('SELECT') \
+            and not _LOCKING.search(clause.text)
+    return False
+
+
+def mark_written(session):
+    """
+    Reads of the session go to the primary from now on (read your writes)
+    and scatter gather queries read the shard through this session
+    """
+    session.info['written'] = True
+
+
+class RoutingSession(Session):
+    """
+    Session that sends reads to a replica and writes, locking reads and
+    every statement issued after the first write to the primary. A
+    replica is picked once per session so reads of a request are
+    consistent
+    """
+    # set by pg.testing while a test runs, binds every session to the
+    # connections of the test
+    isolation = None
+
+    def __init__(self, replicas=None, **kwargs):
+        super(RoutingSession, self).__init__(**kwargs)
+        self.replicas = replicas
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        bind = self._route(mapper, clause, **kwargs)
+        if self.isolation is not None:
+            return self.isolation.bind(bind)
+        return bind
+
+    def _route(self, mapper, clause, **kwargs):
+        primary = super(RoutingSession, self).get_bind(
+            mapper, clause=clause, **kwargs)
+
+        if self.info.get('written'):
+            return primary
+
+        if self._flushing or (clause is not None and not is_read(clause)):
+            mark_written(self)
+            return primary
+
+        if self.replicas is None or clause is None:
+            return primary
+
+        replica = self.info.get('replica')
+        if replica is None:
+            replica = self.replicas.choose()
+            if replica is None:
+                return primary
+            self.info['replica'] = replica
+        replica.reads += 1
+        return replica.engine
+
+
+class EngineRegistry(object):
+    """
+    Process wide registry of engines and scoped sessions, engines are built
+    only once per connection name and shared by every request
+    """
+    def __init__(self):
+        self.connections = {}
+        self._lock = threading.Lock()
+
+    def get_or_create(
+            self, connection_name, connection_string, options=None,
+            scopefunc=None):
+        options = options or {}
+        conn = self.connections.get(connection_name)
+
+        if conn is not None and conn.connection_string == connection_string \
+                and conn.options == options:
+            return conn
+
+        with self._lock:
+            conn = self.connections.get(connection_name)
+            if conn is not None:
+                if conn.connection_string == connection_string \
+                        and conn.options == options:
+                    return conn
+                # the configuration changed, the old engine is released
+                self._dispose(conn)
+
+            kwargs = engine_options(options)
+            kwargs.update(
+                poolclass=InstrumentedQueuePool,
+                pool_logging_name=connection_name)
+            engine = create_engine(connection_string, **kwargs)
+            instrument_engine(engine, connection_name)
+
+            replicas = None
+            replica_urls, replica_kwargs = replica_options(options)
+            if replica_urls:
+                replicas = ReplicaSet([
+                    Replica(create_engine(url, **kwargs), url)
+                    for url in replica_urls
+                ], **replica_kwargs)
+                for replica in replicas.replicas:
+                    instrument_engine(replica.engine, connection_name)
+
+            session = scoped_session(
+                sessionmaker(class_=RoutingSession), scopefunc=scopefunc)
+            # TWO_PHASE sessions commit through PREPARE TRANSACTION when
+            # several connections are committed together
+            session.configure(
+                bind=engine, replicas=replicas,
+                twophase=as_bool(options.get('TWO_PHASE')),
+                info={'connection_name': connection_name})
+            conn = Connection(
+                engine, session, connection_string, options, replicas)
+            self.connections[connection_name] = conn
+            return conn
+
+    def _dispose(self, conn):
+        conn.engine.dispose()
+        if conn.replicas is not None:
+            conn.replicas.dispose()
+
+    def clear(self):
+        """
+        Disposes every engine, mostly useful for tests and benchmarks
+        """
+        with self._lock:
+            for conn in self.connections.values():
+                self._dispose(conn)
+            self.connections.clear()
+
+
+registry = EngineRegistry()
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def count_commit(session):
+    metrics.transactions.inc(
+        session.info.get('connection_name', ''), 'commit')
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def count_rollback(session):
+    metrics.transactions.inc(
+        session.info.get('connection_name', ''), 'rollback')
+
+
+def _pool_gauge(name, help, value):
+    def collect():
+        return {
+            (connection_name, ): value(conn.engine.pool)
+            for connection_name, conn in list(registry.connections.items())
+        }
+    return metrics.register(
+        metrics.Gauge(name, help, ('connection', ), collect))
+
+
+_pool_gauge(
+    'pg_pool_size', 'Connections kept by the pool', lambda p: p.size())
+_pool_gauge(
+    'pg_pool_checked_out', 'Connections in use',
+    lambda p: p.checkedout())
+_pool_gauge(
+    'pg_pool_overflow', 'Connections opened over the pool size',
+    lambda p: max(0, p.overflow()))
+
+
+class LazyConnections(collections.abc.Mapping):
+    """
+    Connections of an application by name, the engine and session of a
+    connection are only built, or borrowed from the registry, the first
+    time the name is looked up
+    """
+    def __init__(self, registry, config, scopefunc=None):
+        self._registry = registry
+        self._config = config
+        self._scopefunc = scopefunc
+
+    def __getitem__(self, connection_name):
+        connection_string, options = self._config[connection_name]
+        return self._registry.get_or_create(
+            connection_name, connection_string, options,
+            scopefunc=self._scopefunc)
+
+    def __iter__(self):
+        return iter(self._config)
+
+    def __len__(self):
+        return len(self._config)
+
+    def opened(self):
+        """
+        Connections that were already built, nothing is created
+        """
+        return {
+            name: conn
+            for name, conn in list(self._registry.connections.items())
+            if (conn.connection_string, conn.options) == self._config.get(
+                name, (None, None))
+        }
+
+
+class ConnectionPool:
+    """
+    Multiple postgresql database connections support, engines and sessions
+    are borrowed from the process wide registry on first use
+    """
+    def __init__(self, scopefunc=None, registry=registry):
         self.scopefunc = scopefunc
+        self.registry = registry
         self.app = current_app._get_current_object()
         self.initialize_connections()
 
     def initialize_connections(self):
         """
-        Initialize a database connection by each connection string
-        defined in the configuration file
+        Reads the connection strings defined in the configuration, engines
+        are created when a connection name is used for the first time
         """
-
-        for k, v in self.app.config.items():
-            if k.startswith('SQLALCHEMY'):
-                connection_string = v
-                connection_name = k
-                engine = create_engine(connection_string)
-                session = scoped_session(sessionmaker(), scopefunc=self.scopefunc)
-                session.configure(bind=engine)
-                self.connections[connection_name] = Connection(engine, session)
-
+        self.connections = LazyConnections(
+            self.registry, parse_connections(self.app.config),
+            scopefunc=self.scopefunc)
 
     def get_session(self, connection_name='SQLALCHEMY_DEFAULT'):
         return self.connections[connection_name].session
 
-
     def close(self):
-        for k, v in self.connections.items():
+        for k, v in self.connections.opened().items():
             v.session.remove()
 
-    def commit(self, connection_name='SQLALCHEMY_DEFAULT'):
-        if connection_name is None:
-            for conn_name, conn in self.connections.items():
-                conn.session.commit()
-        else:
+    def sessions(self):
+        """
+        Sessions opened by the current scope, connections that were not
+        used are left alone
+        """
+        return {
+            name: conn.session()
+            for name, conn in self.connections.opened().items()
+            if conn.session.registry.has()
+        }
+
+    def commit(self, connection_name='SQLALCHEMY_DEFAULT', timeout=None):
+        """
+        Commits one connection, or every open session concurrently when
+        connection_name is None. When every session in a transaction was
+        configured with TWO_PHASE the commit is atomic: all of them are
+        prepared first and committed only if every PREPARE TRANSACTION
+        succeeded
+        """
+        if connection_name is not None:
             self.connections[connection_name].session.commit()
+            return
 
-    def rollback(self, connection_name='SQLALCHEMY_DEFAULT'):
-        if connection_name is None:
-            for conn_name, conn in self.connections.items():
-                conn.session.rollback()
+        sessions = {
+            name: session for name, session in self.sessions().items()
+            if session.in_transaction()
+        }
+        if len(sessions) > 1 and all(
+                s.twophase for s in sessions.values()):
+            self._commit_twophase(sessions, timeout)
         else:
-            self.connections[connection_name].session.rollback()
+            run_parallel(
+                {name: s.commit for name, s in sessions.items()},
+                timeout=timeout)
+
+    def _commit_twophase(self, sessions, timeout):
+        prepared = {}
+
+        def prepare(name, session):
+            connection = session.connection()
+            xid = connection.get_transaction().xid
+            session.prepare()
+            prepared[name] = (connection.engine, xid)
 
+        def rollback(name, session):
+            try:
+                session.rollback()
+            except Exception:
+                if name not in prepared:
+                    raise
+                # the prepared transaction would hold its locks until it
+                # is resolved by hand
+                rollback_prepared(*prepared[name])
 
+        try:
+            run_parallel({
+                name: functools.partial(prepare, name, session)
+                for name, session in sessions.items()
+            }, timeout=timeout)
+        except Exception:
+            # every PREPARE has finished, also after a timeout. Prepared
+            # transactions are rolled back with ROLLBACK PREPARED
+            run_parallel({
+                name: functools.partial(rollback, name, session)
+                for name, session in sessions.items()
+            })
+            raise
+
+        run_parallel(
+            {name: s.commit for name, s in sessions.items()},
+            timeout=timeout)
+
+    def rollback(self, connection_name='SQLALCHEMY_DEFAULT', timeout=None):
+        if connection_name is not None:
+            self.connections[connection_name].session.rollback()
+            return
 
+        run_parallel(
+            {name: s.rollback for name, s in self.sessions().items()},
+            timeout=timeout)
@@ -0,0 +1,210 @@
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from pg import metrics
+
+import asyncio
+import threading
+import time
+
+
+# bcrypt is imported on first use so it does not slow down app startup
+
+def _hashpw(password, rounds):
+    import bcrypt
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _checkpw(password, hashed):
+    import bcrypt
+    return bcrypt.checkpw(password, hashed)
+
+
+class HashStats(object):
+    """
+    Latency and volume counters of one kind of bcrypt operation
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total_seconds': self.total,
+            'max_seconds': self.max,
+            'avg_seconds': self.total / self.count if self.count else 0.0,
+        }
+
+
+class BcryptHasher(object):
+    """
+    Runs bcrypt hash and verify operations inline, in a thread pool or in
+    a process pool so they don't hold the request thread on the CPU.
+
+    backend:
+        'inline': bcrypt runs on the calling thread
+        'thread': bcrypt releases the GIL, threads are enough to use
+            several cores
+        'process': bcrypt runs in worker processes
+    max_workers: number of concurrent bcrypt operations
+    max_pending: submissions block once this many operations are queued
+        or running
+    """
+    BACKENDS = {
+        'thread': ThreadPoolExecutor,
+        'process': ProcessPoolExecutor,
+    }
+
+    def __init__(self, backend='inline', max_workers=None, max_pending=None):
+        if backend != 'inline' and backend not in self.BACKENDS:
+            raise ValueError('Unknown bcrypt backend {}'.format(backend))
+
+        self.backend = backend
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.in_flight = 0
+        self.stats = {'hash': HashStats(), 'verify': HashStats()}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+
+        if backend != 'inline':
+            self._executor = self.BACKENDS[backend](max_workers=max_workers)
+            self.max_workers = self._executor._max_workers
+            if max_pending:
+                self._slots = threading.BoundedSemaphore(max_pending)
+
+    @property
+    def queue_depth(self):
+        """
+        Operations waiting for a free worker
+        """
+        if self._executor is None:
+            return 0
+        return max(0, self.in_flight - self.max_workers)
+
+    def _finished(self, kind, start):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.in_flight -= 1
+            self.stats[kind].record(elapsed)
+        metrics.bcrypt_seconds.observe(elapsed, kind)
+        if self._slots is not None:
+            self._slots.release()
+
+    def _submit(self, kind, func, *args):
+        if self._slots is not None:
+            self._slots.acquire()
+        with self._lock:
+            self.in_flight += 1
+        start = time.perf_counter()
+
+        if self._executor is None:
+            future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._finished(kind, start)
+            return future
+
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._finished(kind, start)
+            raise
+        future.add_done_callback(lambda f: self._finished(kind, start))
+        return future
+
+    def hash_future(self, password, rounds):
+        """
+        Returns a future with the bcrypt hash of password
+        """
+        if isinstance(password, str):
+            password = password.encode('utf-8')
+        return self._submit('hash', _hashpw, password, rounds)
+
+    def verify_future(self, password, hashed):
+        """
+        Returns a future with True if password matches hashed
+        """
+        if isinstance(password, str):
+            password = password.encode('utf-8')
+        if isinstance(hashed, str):
+            hashed = hashed.encode('utf-8')
+        return self._submit('verify', _checkpw, password, hashed)
+
+    def hash(self, password, rounds):
+        return self.hash_future(password, rounds).result()
+
+    def verify(self, password, hashed):
+        return self.verify_future(password, hashed).result()
+
+    async def hash_async(self, password, rounds):
+        return await asyncio.wrap_future(self.hash_future(password, rounds))
+
+    async def verify_async(self, password, hashed):
+        return await asyncio.wrap_future(
+            self.verify_future(password, hashed))
+
+    def metrics(self):
+        return {
+            'backend': self.backend,
+            'max_workers': self.max_workers,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth,
+            'hash': self.stats['hash'].as_dict(),
+            'verify': self.stats['verify'].as_dict(),
+        }
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+
+hasher = BcryptHasher()
+
+
+def configure(backend='inline', max_workers=None, max_pending=None):
+    """
+    Replaces the process wide hasher used by pg.types.PasswordHash
+    """
+    global hasher
+    previous = hasher
+    hasher = BcryptHasher(
+        backend=backend, max_workers=max_workers, max_pending=max_pending)
+    previous.shutdown(wait=False)
+    return hasher
+
+
+def configure_from_app(app):
+    """
+    Configures the hasher from BCRYPT_BACKEND, BCRYPT_MAX_WORKERS and
+    BCRYPT_MAX_PENDING configuration values
+    """
+    backend = app.config.get('BCRYPT_BACKEND')
+    if not backend:
+        return hasher
+
+    max_workers = app.config.get('BCRYPT_MAX_WORKERS')
+    max_workers = int(max_workers) if max_workers else None
+    max_pending = app.config.get('BCRYPT_MAX_PENDING')
+    max_pending = int(max_pending) if max_pending else None
+
+    if hasher.backend == backend and hasher.max_pending == max_pending \
+            and max_workers in (None, hasher.max_workers):
+        return hasher
+    return configure(
+        backend=backend, max_workers=max_workers, max_pending=max_pending)
+
+
+def get_hasher():
+    return hasher
@@ -0,0 +1,81 @@
+from flask import Blueprint, Response, current_app, request
+
+from pg import metrics, slowlog
+from pg.connection import as_bool
+from utils import json_response
+
+import hmac
+import time
+
+
+pg_bp = Blueprint('pg', __name__)
+
+
+@pg_bp.before_app_request
+def start_request_timer():
+    request.environ['pg.started'] = time.perf_counter()
+
+
+@pg_bp.after_app_request
+def observe_request(response):
+    started = request.environ.get('pg.started')
+    if started is not None:
+        metrics.request_seconds.observe(
+            time.perf_counter() - started,
+            request.blueprint or '',
+            request.url_rule.rule if request.url_rule is not None else '',
+            request.method, response.status_code)
+    return response
+
+
+@pg_bp.before_request
+def check_token():
+    """
+    With PG_HTTP_TOKEN the endpoints require an
+    Authorization: Bearer <token> header
+    """
+    token = current_app.config.get('PG_HTTP_TOKEN')
+    if not token:
+        return None
+    header = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(header, 'Bearer {}'.format(token)):
+        return json_response(
+            status=401, data={'error': 'A valid PG_HTTP_TOKEN is required'})
+    return None
+
+
+@pg_bp.route('/metrics')
+def prometheus_metrics() -> Response:
+    """
+    Pool, manager, transaction, bcrypt and request metrics in the
+    Prometheus text format
+    """
+    return Response(
+        metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@pg_bp.route('/slow-queries', methods=['GET', 'DELETE'])
+def slow_queries() -> Response:
+    """
+    Dumps the slow query log, DELETE empties it
+    """
+    slow_log = slowlog.get_slow_log()
+    if slow_log is None:
+        return json_response(
+            status=404, data={'error': 'The slow query log is disabled'})
+
+    if request.method == 'DELETE':
+        slow_log.clear()
+        return json_response(data={'slow_queries': []})
+    return json_response(data={'slow_queries': slow_log.entries()})
+
+
+def config_pg(app, url_prefix='/pg'):
+    """
+    The endpoints expose the captured statements and clear them, the
+    blueprint is registered only when PG_HTTP_ENDPOINTS is enabled
+    """
+    if not as_bool(app.config.get('PG_HTTP_ENDPOINTS', '')):
+        return False
+    app.register_blueprint(pg_bp, url_prefix=url_prefix)
+    return True
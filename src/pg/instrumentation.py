@@ -0,0 +1,245 @@
+from collections import Counter
+from contextlib import contextmanager
+from flask import _app_ctx_stack, request
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+from pg import metrics, slowlog
+
+import json
+import logging
+import re
+import time
+
+
+logger = logging.getLogger('pg.instrumentation')
+
+# psycopg2 placeholders of expanded IN lists, IN (%(id_1_1)s, %(id_1_2)s)
+_IN_LIST = re.compile(r'\(%\(\w+\)s(?:, %\(\w+\)s)+\)')
+_SPACES = re.compile(r'\s+')
+
+DEFAULT_N_PLUS_ONE_THRESHOLD = 10
+
+# callable(connection, statement) returning True for the statements that
+# are not recorded, set by pg.testing
+ignore_statement = None
+
+
+def statement_shape(statement):
+    """
+    Statement text without the details that change between executions of
+    the same query, statements are already parametrized by the driver
+    """
+    return _IN_LIST.sub('(...)', _SPACES.sub(' ', statement).strip())
+
+
+class ConnectionStats(object):
+    def __init__(self):
+        self.queries = 0
+        self.time = 0.0
+        self.rows = 0
+        self.checkouts = 0
+        self.checkout_wait = 0.0
+
+    def as_dict(self):
+        return {
+            'queries': self.queries,
+            'time_ms': round(self.time * 1000, 3),
+            'rows': self.rows,
+            'checkouts': self.checkouts,
+            'checkout_wait_ms': round(self.checkout_wait * 1000, 3),
+        }
+
+
+class RequestStats(object):
+    """
+    Database activity of one request (or of a collect() block) by
+    connection name. Statements whose shape is executed more than
+    n_plus_one_threshold times are reported as N+1 candidates
+    """
+    def __init__(self, n_plus_one_threshold=DEFAULT_N_PLUS_ONE_THRESHOLD):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.connections = {}
+        self.statements = Counter()
+        self.started = time.perf_counter()
+        self.parent = None
+
+    def _connection(self, connection_name):
+        stats = self.connections.get(connection_name)
+        if stats is None:
+            stats = self.connections[connection_name] = ConnectionStats()
+        return stats
+
+    def record_query(self, connection_name, statement, elapsed, rows):
+        stats = self._connection(connection_name)
+        stats.queries += 1
+        stats.time += elapsed
+        stats.rows += rows
+        self.statements[statement_shape(statement)] += 1
+
+    def record_checkout(self, connection_name, elapsed):
+        stats = self._connection(connection_name)
+        stats.checkouts += 1
+        stats.checkout_wait += elapsed
+
+    @property
+    def queries(self):
+        return sum(s.queries for s in self.connections.values())
+
+    @property
+    def time(self):
+        return sum(s.time for s in self.connections.values())
+
+    def n_plus_one(self):
+        """
+        [(statement, executions), ...] of the statements repeated more
+        than n_plus_one_threshold times, most repeated first
+        """
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count > self.n_plus_one_threshold
+        ]
+
+    def as_dict(self):
+        return {
+            'queries': self.queries,
+            'time_ms': round(self.time * 1000, 3),
+            'connections': {
+                name: stats.as_dict()
+                for name, stats in self.connections.items()
+            },
+            'n_plus_one': [
+                {'statement': statement, 'count': count}
+                for statement, count in self.n_plus_one()
+            ],
+        }
+
+    def server_timing(self):
+        """
+        Server-Timing header value, one metric per connection name
+        """
+        return ', '.join(
+            'db_{};dur={:.3f};desc="{} queries, {} rows"'.format(
+                name.lower(), stats.time * 1000, stats.queries, stats.rows)
+            for name, stats in self.connections.items())
+
+
+def current_stats():
+    return getattr(_app_ctx_stack.top, 'pg_stats', None)
+
+
+@contextmanager
+def collect(n_plus_one_threshold=DEFAULT_N_PLUS_ONE_THRESHOLD):
+    """
+    Records the statements issued inside the block in the current
+    application context:
+
+        with collect() as stats:
+            Album.objects.filter_by(...)
+        stats.queries
+    """
+    ctx = _app_ctx_stack.top
+    previous = getattr(ctx, 'pg_stats', None)
+    stats = RequestStats(n_plus_one_threshold=n_plus_one_threshold)
+    ctx.pg_stats = stats
+    try:
+        yield stats
+    finally:
+        ctx.pg_stats = previous
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that reports how long a checkout waited for a connection,
+    the pool logging name is the connection name
+    """
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+        finally:
+            stats = current_stats()
+            if stats is not None:
+                stats.record_checkout(
+                    self._orig_logging_name, time.perf_counter() - start)
+
+
+def instrument_engine(engine, connection_name):
+    """
+    Cursor events that feed the stats of the current request and the slow
+    query log
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(
+            conn, cursor, statement, parameters, context, executemany):
+        context._pg_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(
+            conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._pg_started
+        if ignore_statement is not None and ignore_statement(conn, statement):
+            return
+
+        stats = current_stats()
+        if stats is not None:
+            rows = cursor.rowcount if cursor.description is not None \
+                and cursor.rowcount > 0 else 0
+            stats.record_query(connection_name, statement, elapsed, rows)
+
+        method = context.execution_options.get('pg_manager_method')
+        if method is not None:
+            metrics.manager_seconds.observe(elapsed, *method)
+
+        if slowlog.slow_log is not None and not \
+                context.execution_options.get(slowlog.EXPLAIN_OPTION):
+            slowlog.slow_log.record(
+                connection_name, conn.engine, statement, parameters, elapsed,
+                executemany=executemany)
+
+
+def init_instrumentation(app):
+    """
+    Per request database stats, enabled with PG_INSTRUMENT. They are
+    sent in a Server-Timing header and logged as a JSON line, repeated
+    statements (PG_N_PLUS_ONE_THRESHOLD) are logged as warnings
+    """
+    threshold = int(app.config.get(
+        'PG_N_PLUS_ONE_THRESHOLD', DEFAULT_N_PLUS_ONE_THRESHOLD))
+
+    @app.before_request
+    def start_request_stats():
+        stats = RequestStats(n_plus_one_threshold=threshold)
+        stats.parent = current_stats()
+        _app_ctx_stack.top.pg_stats = stats
+
+    @app.after_request
+    def report_request_stats(response):
+        stats = current_stats()
+        if stats is None:
+            return response
+
+        if stats.connections:
+            response.headers['Server-Timing'] = stats.server_timing()
+        data = stats.as_dict()
+        data.update({
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(
+                (time.perf_counter() - stats.started) * 1000, 3),
+        })
+        logger.info(json.dumps(data))
+        for statement, count in stats.n_plus_one():
+            logger.warning(
+                'N+1 query on %s: %s executed %s times',
+                request.path, statement, count)
+        return response
+
+    @app.teardown_request
+    def stop_request_stats(exception):
+        stats = current_stats()
+        if stats is not None:
+            _app_ctx_stack.top.pg_stats = stats.parent
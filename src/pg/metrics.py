@@ -0,0 +1,248 @@
+from bisect import bisect_left
+
+import functools
+import itertools
+import threading
+import time
+import weakref
+
+
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BCRYPT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value):
+    return str(value).replace(
+        '\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(k, _escape(v)) for k, v in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _add(result, labels, cell):
+    total = result.get(labels)
+    if total is None:
+        result[labels] = list(cell)
+    else:
+        for i, value in enumerate(cell):
+            total[i] += value
+
+
+class _ThreadCells(dict):
+    """
+    {labels: cell} of a thread, kept by its thread local storage so it is
+    released when the thread exits
+    """
+    def __init__(self, token):
+        super(_ThreadCells, self).__init__()
+        self.token = token
+
+
+class Metric(object):
+    """
+    Metric family whose values are kept in cells owned by the thread that
+    writes them, recording never takes a lock (only the first time a
+    thread uses a label set) and cells are added up when scraped. The
+    cells of a thread are folded into shared totals when it exits
+    """
+    kind = None
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._local = threading.local()
+        self._tokens = itertools.count()
+        # {thread token: [(labels, cell)]} of the running threads
+        self._live = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def _new_cell(self):
+        raise NotImplementedError
+
+    def _cell(self, labels):
+        cells = getattr(self._local, 'cells', None)
+        if cells is None:
+            cells = self._local.cells = _ThreadCells(next(self._tokens))
+            with self._lock:
+                self._live[cells.token] = []
+            weakref.finalize(cells, self._fold, cells.token)
+        cell = cells.get(labels)
+        if cell is None:
+            cell = cells[labels] = self._new_cell()
+            with self._lock:
+                self._live[cells.token].append((labels, cell))
+        return cell
+
+    def _fold(self, token):
+        with self._lock:
+            for labels, cell in self._live.pop(token, ()):
+                _add(self._totals, labels, cell)
+
+    def collect(self):
+        """
+        Returns {labels: values} with the cells of every thread added up
+        """
+        with self._lock:
+            result = {
+                labels: list(total)
+                for labels, total in self._totals.items()}
+            cells = [c for live in self._live.values() for c in live]
+        for labels, cell in cells:
+            _add(result, labels, cell)
+        return result
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help),
+            '# TYPE {} {}'.format(self.name, self.kind),
+        ]
+        for labels, values in sorted(self.collect().items()):
+            lines.extend(self._samples(labels, values))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_cell(self):
+        return [0]
+
+    def inc(self, *labels, amount=1):
+        self._cell(labels)[0] += amount
+
+    def value(self, *labels):
+        return self.collect().get(labels, [0])[0]
+
+    def _samples(self, labels, values):
+        yield '{}{} {}'.format(
+            self.name, _labels(self.label_names, labels), _number(values[0]))
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_cell(self):
+        # one slot per bucket, +Inf, then the sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value, *labels):
+        cell = self._cell(labels)
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def count(self, *labels):
+        values = self.collect().get(labels)
+        return sum(values[:-1]) if values else 0
+
+    def _samples(self, labels, values):
+        cumulative = 0
+        for le, count in zip(self.buckets + (float('inf'), ), values[:-1]):
+            cumulative += count
+            yield '{}_bucket{} {}'.format(
+                self.name,
+                _labels(self.label_names, labels, [('le', _number(le))]),
+                cumulative)
+        label_text = _labels(self.label_names, labels)
+        yield '{}_sum{} {}'.format(self.name, label_text, values[-1])
+        yield '{}_count{} {}'.format(self.name, label_text, cumulative)
+
+
+class Gauge(object):
+    """
+    Values read when the metrics are scraped, collect() returns
+    {labels: value}
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, label_names, collect):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.collect = collect
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help),
+            '# TYPE {} {}'.format(self.name, self.kind),
+        ]
+        for labels, value in sorted(self.collect().items()):
+            lines.append('{}{} {}'.format(
+                self.name, _labels(self.label_names, labels),
+                _number(value)))
+        return lines
+
+
+metrics = []
+
+
+def register(metric):
+    metrics.append(metric)
+    return metric
+
+
+def render():
+    """
+    Every registered metric in the Prometheus text format
+    """
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+manager_seconds = register(Histogram(
+    'pg_manager_query_seconds',
+    'Latency of the model manager methods',
+    ('model', 'method')))
+
+transactions = register(Counter(
+    'pg_transactions_total',
+    'Committed and rolled back session transactions',
+    ('connection', 'outcome')))
+
+bcrypt_seconds = register(Histogram(
+    'pg_bcrypt_seconds',
+    'Latency of bcrypt hash and verify operations',
+    ('operation', ), buckets=BCRYPT_BUCKETS))
+
+request_seconds = register(Histogram(
+    'http_request_seconds',
+    'Latency of the requests by blueprint and route',
+    ('blueprint', 'route', 'method', 'status')))
+
+
+def timed(method):
+    """
+    Records the latency of a manager method, the first argument of the
+    decorated function is the manager (or the model instance)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                model = getattr(self, '_model', type(self))
+                manager_seconds.observe(
+                    time.perf_counter() - start, model.__name__, method)
+        return wrapper
+    return decorator
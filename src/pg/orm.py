@@ -1,10 +1,38 @@
-from flask import current_app
-from sqlalchemy import Column, Integer
+from flask import _app_ctx_stack, current_app
+from sqlalchemy import Column, Integer, bindparam, event, func, select
 from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.orm import Query, Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import instance_state, set_committed_value
 from sqlalchemy.sql import text
 
 from pg import PGSqlAlchemy
+from pg.batch import Batch, current_batch
+from pg.bulk import (
+    RowNormalizer, copy_rows, insert_rows, row_values, supports_copy,
+    upsert_rows)
+from pg.cache import LRUCache, count_cache, filters_key
+from pg.connection import mark_written
+from pg.exceptions import InvalidQueryError
+from pg.pagination import (
+    Page, decode_cursor, encode_cursor, keyset_condition, parse_order_by)
+from pg.metrics import timed
+from pg.parallel import run_parallel
+from pg.prefetch import prefetch_options
+from pg.results import Results
 from pg.schema import Base
+from pg.serialization import get_serializer
+from pg.sharding import merge_sorted
+from pg.statements import (
+    LIMIT, OFFSET, Explain, criteria, filter_shape, parameters,
+    statement_cache)
+
+import functools
+import itertools
+
+
+COUNT_EXACT = 'exact'
+COUNT_ESTIMATED = 'estimated'
+COUNT_CACHED = 'cached'
 
 
 class BaseManager(object):
@@ -14,25 +42,234 @@ class BaseManager(object):
     """
     def __init__(self, model):
         self._model = model
-        self._db = None
+        self._cache = None
+
+        # opt-in result cache for get and filter_by
+        ttl = getattr(model, '__cache_ttl__', None)
+        if ttl:
+            self._cache = LRUCache(
+                max_size=getattr(model, '__cache_size__', 1000), ttl=ttl)
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def _cache_key(self, connection_name, method, **kwargs):
+        """
+        None when a filter value can not be hashed, the query is not cached
+        """
+        filters = filters_key(kwargs)
+        if filters is None:
+            return None
+        return (connection_name, method, filters)
+
+    def _cache_store(self, session, key, value):
+        # rows written by a transaction in progress must not leak to
+        # other requests
+        if self._model not in session.info.get('cache_dirty', ()):
+            self._cache.set(key, value)
+
+    def _snapshot(self, obj):
+        state = instance_state(obj)
+        return {
+            attr.key: state.dict[attr.key]
+            for attr in self._model.__mapper__.column_attrs
+            if attr.key in state.dict
+        }
+
+    def _restore(self, session, values):
+        """
+        Returns a session bound instance built from cached column values
+        without querying the database
+        """
+        mapper = self._model.__mapper__
+        identity_key = mapper.identity_key_from_primary_key(
+            [values[c.key] for c in mapper.primary_key])
+        obj = session.identity_map.get(identity_key)
+        if obj is not None:
+            return obj
+
+        obj = mapper.class_manager.new_instance()
+        for k, v in values.items():
+            set_committed_value(obj, k, v)
+        make_transient_to_detached(obj)
+        return session.merge(obj, load=False)
+
+    def invalidate_cache(self, session=None):
+        if self._cache is None:
+            return
+        self._cache.invalidate()
+        if session is not None:
+            session.info.setdefault('cache_dirty', set()).add(self._model)
 
     @property
     def db(self):
-        if self._db is None:
-            self._db = PGSqlAlchemy(current_app._get_current_object())
-        return self._db
+        """
+        Database of the current application context, connections are
+        looked up in the configuration of the application in use
+        """
+        ctx = _app_ctx_stack.top
+        db = getattr(ctx, 'pg_sqlalchemy', None)
+        if db is None or db.app is not current_app._get_current_object():
+            db = PGSqlAlchemy(current_app._get_current_object())
+            ctx.pg_sqlalchemy = db
+        return db
+
+    def connection_for(self, obj, connection_name=None):
+        """
+        Connection name an instance is written to
+        """
+        return connection_name or 'SQLALCHEMY_DEFAULT'
+
+    def batch(self, connection_name='SQLALCHEMY_DEFAULT'):
+        """
+        Defers the flush of add, update and delete (of every model) on the
+        connection until the end of the block:
+
+            with Album.objects.batch() as batch:
+                for name in names:
+                    Album(name=name).add()
+            batch.saved
+        """
+        return Batch([self.db.pool.connections[connection_name].session])
+
+    def _statement(self, method, connection_name, shape, build, *extra):
+        """
+        Statement of a filter shape from the process wide statement cache
+        """
+        return statement_cache.get(
+            (self._model, method, shape, connection_name) + extra, build)
 
 
     def filter_by(
         self, order_by='id', limit=500, offset=0,
+            connection_name='SQLALCHEMY_DEFAULT', prefetch=None, **kwargs):
+        """
+        Returns pg.results.Results, served from the result cache when the
+        model has one (__cache_ttl__). prefetch loads relationships with
+        the query, see pg.prefetch.prefetch_options
+        """
+        session = self.db.pool.connections[connection_name].session
+        shape = filter_shape(self._model, kwargs)
+        if shape is None:
+            query = session.query(
+                self._model
+                ).filter_by(
+                    **kwargs
+                ).order_by(order_by).limit(limit).offset(offset)
+        else:
+            template = self._statement(
+                'filter_by', connection_name, shape,
+                lambda: Query(self._model).filter(
+                    *criteria(self._model, shape)).order_by(order_by).limit(
+                        bindparam(LIMIT)).offset(bindparam(OFFSET)),
+                order_by)
+            query = template.with_session(session()).params(parameters(
+                kwargs, **{LIMIT: limit, OFFSET: offset}))
+        # the query runs later, its statements are timed by the engine events
+        query = query.execution_options(
+            pg_manager_method=(self._model.__name__, 'filter_by'))
+
+        if prefetch:
+            # cached instances are restored without their relationships
+            return Results(query.options(
+                *prefetch_options(self._model, prefetch)))
+
+        key = None if self._cache is None else self._cache_key(
+            connection_name, 'filter_by', order_by=order_by, limit=limit,
+            offset=offset, **kwargs)
+        if key is None:
+            return Results(query)
+
+        values = self._cache.get(key)
+        if values is not None:
+            return Results(
+                query, [self._restore(session, v) for v in values])
+
+        result = query.all()
+        self._cache_store(session, key, [self._snapshot(o) for o in result])
+        return Results(query, result)
+
+    @timed('paginate')
+    def paginate(
+        self, cursor=None, order_by=('id', ), limit=500,
             connection_name='SQLALCHEMY_DEFAULT', **kwargs):
+        """
+        Keyset pagination, returns a Page(items, next_cursor) where
+        next_cursor encodes the sort keys of the last row. Unlike offset
+        pagination every page costs the same no matter how deep it is.
+        Descending keys are prefixed with '-', e.g. ('-created_at', 'id')
+        """
+        keys = parse_order_by(self._model, order_by)
+        names = [name for name, column, descending in keys]
+
+        query = self.db.pool.connections[connection_name].session.query(
+            self._model).filter_by(**kwargs)
+
+        if cursor is not None:
+            values = decode_cursor(cursor, names)
+            query = query.filter(keyset_condition(keys, values))
+
+        query = query.order_by(*[
+            column.desc() if descending else column.asc()
+            for name, column, descending in keys
+        ]).limit(limit + 1)
+
+        items = query.all()
+        next_cursor = None
 
-        return self.db.pool.connections[connection_name].session.query(
+        if len(items) > limit:
+            items = items[:limit]
+            last = items[-1]
+            next_cursor = encode_cursor(names, [
+                getattr(last, column.key) for name, column, descending in keys
+            ])
+        return Page(items, next_cursor)
+
+    def stream(
+        self, fetch_size=1000, order_by='id',
+            connection_name='SQLALCHEMY_DEFAULT', **kwargs):
+        """
+        Iterates over every matching row using a named server side cursor,
+        only fetch_size rows are held in memory at any time
+        """
+        query = self.db.pool.connections[connection_name].session.query(
             self._model
+            ).filter_by(
+                **kwargs
+            ).order_by(order_by).execution_options(
+                stream_results=True,
+                pg_manager_method=(self._model.__name__, 'stream')
+            ).yield_per(fetch_size)
+
+        for obj in query:
+            yield obj
+
+    @timed('values')
+    def values(
+        self, only=None, exclude=None, order_by='id', limit=500, offset=0,
+            connection_name='SQLALCHEMY_DEFAULT', **kwargs):
+        """
+        Same filters as filter_by, returns JSON ready dictionaries built
+        straight from the selected rows without building ORM objects
+        """
+        serializer = get_serializer(self._model, only=only, exclude=exclude)
+        rows = self.db.pool.connections[connection_name].session.query(
+            *serializer.columns
             ).filter_by(
                 **kwargs
             ).order_by(order_by).limit(limit).offset(offset)
+        return serializer.dump_rows(rows)
+
+    def serialize(self, objs, only=None, exclude=None, nested=None):
+        """
+        Serializes a query result or a list of instances in one call
+        """
+        return get_serializer(
+            self._model, only=only, exclude=exclude,
+            nested=nested).dump_many(objs)
 
+    @timed('get_for_update')
     def get_for_update(self, connection_name='SQLALCHEMY_DEFAULT', **kwargs):
 
         """
@@ -49,37 +286,455 @@ class BaseManager(object):
             raise Exception('Object not found')
         return obj
 
-    def get(self, connection_name='SQLALCHEMY_DEFAULT', **kwargs):
+    @timed('get')
+    def get(
+            self, connection_name='SQLALCHEMY_DEFAULT', prefetch=None,
+            **kwargs):
 
         if not kwargs:
             raise Exception(
                 "Can not execute a query without parameters")
-        obj = self.db.pool.connections[
-            connection_name].session.query(
-                self._model).filter_by(**kwargs).first()
+        session = self.db.pool.connections[connection_name].session
+        key = None
+        if self._cache is not None and not prefetch:
+            key = self._cache_key(connection_name, 'get', **kwargs)
+
+        if key is not None:
+            values = self._cache.get(key)
+            if values is not None:
+                return self._restore(session, values)
+
+        shape = filter_shape(self._model, kwargs)
+        if shape is None:
+            obj = session.query(self._model).filter_by(**kwargs).options(
+                *prefetch_options(self._model, prefetch)).first()
+        else:
+            statement = self._statement(
+                'get', connection_name, shape,
+                lambda: select(self._model).where(
+                    *criteria(self._model, shape)).limit(1))
+            if prefetch:
+                statement = statement.options(
+                    *prefetch_options(self._model, prefetch))
+            # unique() is required by joined collections
+            obj = session.execute(
+                statement, parameters(kwargs)).scalars().unique().first()
 
         if not obj:
             raise Exception('Object not found')
+
+        if key is not None:
+            self._cache_store(session, key, self._snapshot(obj))
         return obj
 
-    def count(self, connection_name='SQLALCHEMY_DEFAULT'):
-        result = self.db.pool.connections[connection_name].session.execute(
-            'SELECT count(id) from {}'.format(self._model.__table__.name)
-        )
+    @timed('count')
+    def count(
+        self, mode=COUNT_EXACT, ttl=60,
+            connection_name='SQLALCHEMY_DEFAULT', **kwargs):
+        """
+        Counts the rows that match kwargs (same filters as filter_by)
+
+        mode:
+            COUNT_EXACT: SELECT count(id), always a scan
+            COUNT_ESTIMATED: planner estimate, pg_class.reltuples for
+                unfiltered counts or EXPLAIN for filtered ones
+            COUNT_CACHED: exact count cached for ttl seconds by
+                connection name, table and filters
+        """
+        if mode == COUNT_ESTIMATED:
+            return self._estimated_count(connection_name, **kwargs)
+
+        if mode == COUNT_CACHED:
+            filters = filters_key(kwargs)
+            if filters is None:
+                return self.count(connection_name=connection_name, **kwargs)
+            key = (connection_name, self._model.__table__.name, filters)
+            result = count_cache.get(key)
+            if result is None:
+                result = self.count(
+                    connection_name=connection_name, **kwargs)
+                count_cache.set(key, result, ttl)
+            return result
+
+        if mode != COUNT_EXACT:
+            raise InvalidQueryError('Unknown count mode {}'.format(mode))
 
-        r = result.fetchone()
-        if len(r) > 0:
-            return r[0]
+        session = self.db.pool.connections[connection_name].session
+        shape = filter_shape(self._model, kwargs)
+        if shape is None:
+            result = session.query(
+                func.count(self._model.id)).filter_by(**kwargs).scalar()
         else:
-            return 0
+            statement = self._statement(
+                'count', connection_name, shape,
+                lambda: select(func.count(self._model.id)).where(
+                    *criteria(self._model, shape)))
+            result = session.execute(statement, parameters(kwargs)).scalar()
+        return result or 0
 
-    def raw_sql(self, sql, connection_name='SQLALCHEMY_DEFAULT', **kwargs):
+    def _estimated_count(self, connection_name, **kwargs):
+        session = self.db.pool.connections[connection_name].session
+
+        if not kwargs:
+            # reltuples is -1 for tables that were never analyzed
+            estimate = session.execute(
+                text(
+                    'SELECT reltuples::bigint FROM pg_class '
+                    'WHERE oid = to_regclass(:table_name)'
+                ).execution_options(pg_replica=True),
+                {'table_name': self._model.__table__.name}).scalar()
+            if estimate is not None and estimate >= 0:
+                return estimate
+
+        statement = session.query(self._model.id).filter_by(
+            **kwargs).statement
+        plan = session.execute(Explain(statement)).scalar()
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    @timed('raw_sql')
+    def raw_sql(
+        self, sql, connection_name='SQLALCHEMY_DEFAULT', replica=False,
+            **kwargs):
+        """
+        Runs sql on the primary, replica=True sends a SELECT that neither
+        locks nor writes to a replica
+        """
+        statement = text(sql)
+        if replica:
+            statement = statement.execution_options(pg_replica=True)
         return self.db.pool.connections[
-            connection_name].session.execute(text(sql), kwargs)
+            connection_name].session.execute(statement, kwargs)
 
+    @timed('add_all')
     def add_all(self, data, connection_name='SQLALCHEMY_DEFAULT'):
         return self.db.pool.connections[connection_name].session.add_all(data)
 
+    @timed('bulk_insert')
+    def bulk_insert(
+        self, rows, returning=False, batch_size=1000, use_copy=True,
+            connection_name='SQLALCHEMY_DEFAULT'):
+        """
+        Inserts dictionaries or model instances without building ORM
+        objects. Rows are streamed with COPY FROM STDIN when the driver
+        supports it, otherwise they are sent as multi row INSERT statements
+        of batch_size rows. Column defaults (created_at, updated_at) and
+        bind processing (Password, GUID) are applied to every row.
+        Returns the generated ids when returning is True, otherwise the
+        number of inserted rows
+        """
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return [] if returning else 0
+
+        table = self._model.__table__
+        session = self.db.pool.connections[connection_name].session
+        self.invalidate_cache(session)
+        mark_written(session)
+        connection = session.connection()
+        normalize = RowNormalizer(table, connection, first)
+        normalized = map(normalize, itertools.chain([first], rows))
+
+        if returning:
+            result = insert_rows(
+                connection, table, normalized, batch_size,
+                returning=[table.c.id])
+            return [r[0] for r in result]
+
+        if use_copy and supports_copy(connection):
+            return copy_rows(
+                connection, table, normalize.columns, normalized)
+        return insert_rows(connection, table, normalized, batch_size)
+
+    @timed('upsert_many')
+    def upsert_many(
+        self, rows, conflict_columns, update_columns=None, batch_size=1000,
+            connection_name='SQLALCHEMY_DEFAULT'):
+        """
+        Inserts rows or updates the existing ones identified by
+        conflict_columns (which need a unique constraint) using batched
+        INSERT ... ON CONFLICT statements. update_columns defaults to the
+        columns of the first row, an empty list means DO NOTHING.
+        updated_at is refreshed on every updated row. Returns the ids in
+        the same order as rows
+        """
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return []
+
+        table = self._model.__table__
+        if update_columns is None:
+            update_columns = [
+                k for k in row_values(first)
+                if k in table.c and k not in conflict_columns
+                and not table.c[k].primary_key
+            ]
+
+        session = self.db.pool.connections[connection_name].session
+        self.invalidate_cache(session)
+        mark_written(session)
+        connection = session.connection()
+        normalize = RowNormalizer(table, connection, first)
+        return upsert_rows(
+            connection, table,
+            map(normalize, itertools.chain([first], rows)),
+            conflict_columns, update_columns, batch_size)
+
+
+class ShardedManager(BaseManager):
+    """
+    Manager of models partitioned across connections with __shards__
+    (pg.sharding.Shards). Queries and writes that carry the shard key go
+    to a single shard, get, filter_by and count without it are sent to
+    every shard in parallel and their results merged. An explicit
+    connection_name always wins
+    """
+    def __init__(self, model):
+        super(ShardedManager, self).__init__(model)
+        self.shards = model.__shards__
+
+    def connection_for(self, obj, connection_name=None):
+        return self.shards.route_object(obj, connection_name)
+
+    def batch(self, connection_name=None):
+        """
+        Deferred flush on every shard, or on connection_name
+        """
+        names = [connection_name] if connection_name else self.shards.names
+        return Batch([
+            self.db.pool.connections[name].session for name in names])
+
+    def _scatter(self, names, query):
+        """
+        Runs query(session) on every shard and returns {name: result}.
+        Each shard is read in its own thread and session, except the
+        shards written by the current session which are read through it
+        so uncommitted rows are visible. Instances are returned attached
+        to the current session of their shard
+        """
+        connections = self.db.pool.connections
+        results = {}
+        remote = {}
+
+        for name in names:
+            scoped = connections[name].session
+            if scoped.registry.has() and scoped().info.get('written'):
+                results[name] = query(scoped())
+            else:
+                remote[name] = functools.partial(
+                    self._query_shard, connections[name], query)
+
+        for name, result in run_parallel(
+                remote, timeout=self.shards.timeout).items():
+            session = connections[name].session
+            if isinstance(result, list):
+                result = [session.merge(o, load=False) for o in result]
+            elif isinstance(result, self._model):
+                result = session.merge(result, load=False)
+            results[name] = result
+        return results
+
+    @staticmethod
+    def _query_shard(connection, query):
+        session = connection.session.session_factory()
+        try:
+            return query(session)
+        finally:
+            session.close()
+
+    def filter_by(
+        self, order_by='id', limit=500, offset=0, connection_name=None,
+            prefetch=None, **kwargs):
+        """
+        Returns the results of a single shard, or the first limit rows of
+        the ordered merge of every shard. Every shard returns offset +
+        limit rows so deep offsets are expensive
+        """
+        names = self.shards.route(connection_name, kwargs)
+        if len(names) == 1:
+            return super(ShardedManager, self).filter_by(
+                order_by=order_by, limit=limit, offset=offset,
+                connection_name=names[0], prefetch=prefetch, **kwargs)
+        return self._scatter_filter_by(
+            names, order_by, limit, offset, prefetch, kwargs)
+
+    @timed('filter_by')
+    def _scatter_filter_by(
+            self, names, order_by, limit, offset, prefetch, kwargs):
+        keys = parse_order_by(self._model, order_by)
+        model = self._model
+        options = prefetch_options(model, prefetch)
+
+        order = [
+            column.desc() if descending else column.asc()
+            for name, column, descending in keys
+        ]
+
+        def query(session):
+            return session.query(model).filter_by(**kwargs).options(
+                *options).order_by(*order).limit(offset + limit).all()
+
+        results = self._scatter(names, query)
+        merged = merge_sorted(
+            [results[name] for name in names],
+            [(column.key, descending) for name, column, descending in keys])
+        return Results(rows=merged[offset:offset + limit])
+
+    def get(self, connection_name=None, prefetch=None, **kwargs):
+        """
+        Without the shard key every shard is queried, InvalidQueryError is
+        raised when more than one shard has a matching row
+        """
+        names = self.shards.route(connection_name, kwargs)
+        if len(names) == 1:
+            return super(ShardedManager, self).get(
+                connection_name=names[0], prefetch=prefetch, **kwargs)
+
+        if not kwargs:
+            raise Exception(
+                "Can not execute a query without parameters")
+        return self._scatter_get(names, prefetch, kwargs)
+
+    @timed('get')
+    def _scatter_get(self, names, prefetch, kwargs):
+        model = self._model
+        options = prefetch_options(model, prefetch)
+        results = self._scatter(
+            names,
+            lambda session: session.query(model).filter_by(
+                **kwargs).options(*options).first())
+        found = [results[name] for name in names if results[name] is not None]
+        if len(found) > 1:
+            # ids and other columns are only unique within a shard
+            raise InvalidQueryError(
+                'get matched rows in {} shards, filter by {}'.format(
+                    len(found), self.shards.key))
+        if not found:
+            raise Exception('Object not found')
+        return found[0]
+
+    def count(self, mode=COUNT_EXACT, ttl=60, connection_name=None, **kwargs):
+        """
+        Counts a single shard, or sums the counts of every shard
+        """
+        names = self.shards.route(connection_name, kwargs)
+        if len(names) > 1 and mode == COUNT_EXACT:
+            return self._scatter_count(names, kwargs)
+
+        return sum(
+            super(ShardedManager, self).count(
+                mode=mode, ttl=ttl, connection_name=name, **kwargs)
+            for name in names)
+
+    @timed('count')
+    def _scatter_count(self, names, kwargs):
+        model = self._model
+        results = self._scatter(
+            names,
+            lambda session: session.query(
+                func.count(model.id)).filter_by(**kwargs).scalar() or 0)
+        return sum(results.values())
+
+    def _partition(self, rows):
+        key = self.shards.key
+        return self.shards.partition(
+            rows, lambda row: row_values(row).get(key))
+
+    def add_all(self, data, connection_name=None):
+        if connection_name is not None:
+            return super(ShardedManager, self).add_all(
+                data, connection_name=connection_name)
+
+        for name, rows in self._partition(data).items():
+            super(ShardedManager, self).add_all(
+                [row for position, row in rows], connection_name=name)
+
+    def bulk_insert(
+        self, rows, returning=False, batch_size=1000, use_copy=True,
+            connection_name=None):
+        """
+        Rows are grouped by shard, returned ids keep the input order and
+        are only unique within their shard
+        """
+        if connection_name is not None:
+            return super(ShardedManager, self).bulk_insert(
+                rows, returning=returning, batch_size=batch_size,
+                use_copy=use_copy, connection_name=connection_name)
+
+        groups = self._partition(rows)
+        ids = {}
+        count = 0
+        for name, group in groups.items():
+            result = super(ShardedManager, self).bulk_insert(
+                [row for position, row in group], returning=returning,
+                batch_size=batch_size, use_copy=use_copy,
+                connection_name=name)
+            if returning:
+                ids.update(zip([position for position, row in group], result))
+            else:
+                count += result
+        return [ids[i] for i in range(len(ids))] if returning else count
+
+    def upsert_many(
+        self, rows, conflict_columns, update_columns=None, batch_size=1000,
+            connection_name=None):
+        """
+        Rows are grouped by shard, conflict_columns should include the
+        shard key so a row never lives in two shards
+        """
+        if connection_name is not None:
+            return super(ShardedManager, self).upsert_many(
+                rows, conflict_columns, update_columns=update_columns,
+                batch_size=batch_size, connection_name=connection_name)
+
+        ids = {}
+        for name, group in self._partition(rows).items():
+            result = super(ShardedManager, self).upsert_many(
+                [row for position, row in group], conflict_columns,
+                update_columns=update_columns, batch_size=batch_size,
+                connection_name=name)
+            ids.update(zip([position for position, row in group], result))
+        return [ids[i] for i in range(len(ids))]
+
+
+@event.listens_for(Session, 'after_flush')
+def invalidate_flushed_models(session, flush_context):
+    """
+    Drops the cached results of every model written by a flush, the models
+    stay flagged until the transaction ends
+    """
+    models = set(
+        type(obj) for obj in itertools.chain(
+            session.new, session.dirty, session.deleted))
+    for model in models:
+        if isinstance(getattr(model, 'objects', None), BaseManager):
+            model.objects.invalidate_cache(session)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def invalidate_transaction_models(session):
+    for model in session.info.pop('cache_dirty', ()):
+        model.objects.invalidate_cache()
+
+
+class _AsyncManager(object):
+    """
+    async_objects of every model, built on first use so sync users do not
+    import pg.aio (sqlalchemy.ext.asyncio). A declared_attr would be
+    evaluated for every model when its class is created
+    """
+    def __init__(self):
+        self._managers = {}
+
+    def __get__(self, obj, cls):
+        manager = self._managers.get(cls)
+        if manager is None:
+            from pg.aio import AsyncBaseManager
+            manager = self._managers.setdefault(cls, AsyncBaseManager(cls))
+        return manager
+
 
 class BaseModel(Base):
     """Abstract base model, contains common field and methods for all models
@@ -96,22 +751,56 @@ class BaseModel(Base):
 
     @property
     def dict(self):
-        val = {
-            k: v for k, v in self.__dict__.items() if (not k.startswith('_'))
-        }
-        return val
+        return self.serializer().dump(self)
+
+    @classmethod
+    def serializer(cls, only=None, exclude=None, nested=None):
+        return get_serializer(
+            cls, only=only, exclude=exclude, nested=nested)
 
     @declared_attr
     def objects(cls):
+        if getattr(cls, '__shards__', None) is not None:
+            return ShardedManager(cls)
         return BaseManager(cls)
 
-    def update(self, connection_name='SQLALCHEMY_DEFAULT'):
-        self.objects.db.pool.connections[connection_name].session.flush()
+    async_objects = _AsyncManager()
+
+    def _session(self, connection_name):
+        connection_name = self.objects.connection_for(self, connection_name)
+        return self.objects.db.pool.connections[connection_name].session
+
+    @timed('update')
+    def update(self, connection_name=None):
+        session = self._session(connection_name)
+        batch = current_batch(session)
+        if batch is not None:
+            return batch.update(session, self)
+        session.flush()
 
-    def add(self, connection_name='SQLALCHEMY_DEFAULT'):
-        self.objects.db.pool.connections[connection_name].session.add(self)
-        self.objects.db.pool.connections[connection_name].session.flush()
+    @timed('add')
+    def add(self, connection_name=None):
+        session = self._session(connection_name)
+        batch = current_batch(session)
+        if batch is not None:
+            return batch.add(session, self)
+        session.add(self)
+        session.flush()
 
-    def delete(self, connection_name='SQLALCHEMY_DEFAULT'):
-        self.objects.db.pool.connections[connection_name].session.delete(self)
-        self.objects.db.pool.connections[connection_name].session.flush()
+    @timed('delete')
+    def delete(self, connection_name=None):
+        session = self._session(connection_name)
+        batch = current_batch(session)
+        if batch is not None:
+            return batch.delete(session, self)
+        session.delete(self)
+        session.flush()
+
+
+@event.listens_for(BaseModel, 'mapper_configured', propagate=True)
+def build_default_serializer(mapper, cls):
+    """
+    The default serializer of every model is resolved once its mapper
+    is configured
+    """
+    get_serializer(cls)
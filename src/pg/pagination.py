@@ -0,0 +1,138 @@
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal
+from sqlalchemy import and_, or_, tuple_
+
+from pg.exceptions import InvalidQueryError
+
+import base64
+import json
+import uuid
+
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    elif isinstance(value, date):
+        return {'d': value.isoformat()}
+    elif isinstance(value, uuid.UUID):
+        return {'u': str(value)}
+    elif isinstance(value, Decimal):
+        return {'n': str(value)}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        elif 'd' in value:
+            return date.fromisoformat(value['d'])
+        elif 'u' in value:
+            return uuid.UUID(value['u'])
+        elif 'n' in value:
+            return Decimal(value['n'])
+        raise ValueError('Unknown cursor value {}'.format(value))
+    return value
+
+
+def encode_cursor(keys, values):
+    """
+    Builds an opaque cursor from the sort keys and the values of the
+    last row of a page
+    """
+    content = json.dumps(
+        [list(keys), [_encode_value(v) for v in values]],
+        separators=(',', ':'))
+    return base64.urlsafe_b64encode(content.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, keys):
+    """
+    Returns the values stored in a cursor, the cursor must have been built
+    with the same sort keys
+    """
+    try:
+        content = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        cursor_keys, values = json.loads(content.decode('utf-8'))
+        values = [_decode_value(v) for v in values]
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise InvalidQueryError('Invalid cursor: {}'.format(e))
+
+    if cursor_keys != list(keys) or len(values) != len(keys):
+        raise InvalidQueryError(
+            'Cursor does not match order by {}'.format(keys))
+    return values
+
+
+def parse_order_by(model, order_by):
+    """
+    Translates order by names such as ('-created_at', 'id') into
+    (name, column, descending) triples, the primary key is always used as
+    tie breaker
+    """
+    if isinstance(order_by, str):
+        order_by = (order_by, )
+
+    keys = []
+    for name in order_by:
+        descending = name.startswith('-')
+        column_name = name.lstrip('-')
+        column = getattr(model.__table__.c, column_name, None)
+        if column is None:
+            raise InvalidQueryError(
+                'Can not order {} by {}'.format(
+                    model.__name__, column_name))
+        keys.append((name, column, descending))
+
+    if 'id' not in [column.name for name, column, descending in keys]:
+        descending = keys[-1][2] if keys else False
+        keys.append(
+            ('-id' if descending else 'id', model.__table__.c.id, descending))
+    return keys
+
+
+def _equals(column, value):
+    return column.is_(None) if value is None else column == value
+
+
+def _after(column, value, descending):
+    """
+    Rows after value in the postgres order of column, NULLS LAST when
+    ascending and NULLS FIRST when descending. None when no row is
+    """
+    if descending:
+        return column.isnot(None) if value is None else column < value
+    if value is None:
+        return None
+    if column.nullable:
+        return or_(column > value, column.is_(None))
+    return column > value
+
+
+def keyset_condition(keys, values):
+    """
+    Where clause that selects the rows after values, row comparisons are
+    used when every key goes in the same direction and no column is
+    nullable so postgres can use a composite index. Comparisons with NULL
+    are never true, nullable columns get explicit IS NULL branches
+    """
+    directions = set(descending for name, column, descending in keys)
+    columns = [column for name, column, descending in keys]
+
+    if len(directions) == 1 and not any(c.nullable for c in columns):
+        if directions.pop():
+            return tuple_(*columns) < tuple_(*values)
+        return tuple_(*columns) > tuple_(*values)
+
+    clauses = []
+    for i, (name, column, descending) in enumerate(keys):
+        after = _after(column, values[i], descending)
+        if after is None:
+            continue
+        equals = [_equals(columns[j], values[j]) for j in range(i)]
+        clauses.append(and_(*(equals + [after])))
+    return or_(*clauses)
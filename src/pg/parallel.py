@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import threading
+
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Process wide thread pool shared by scatter gather queries and
+    per connection lifecycle operations
+    """
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(thread_name_prefix='pg')
+    return _executor
+
+
+def run_parallel(tasks, timeout=None):
+    """
+    Runs a dictionary of {name: callable} concurrently and returns
+    {name: result}. The first exception raised by a task is re-raised
+    once every task has finished, TimeoutError is raised when
+    they don't finish within timeout seconds. Tasks that did not start
+    by then are cancelled and running ones, which can not be interrupted,
+    are waited for: no task is left using a session once the caller gets
+    the error
+    """
+    if len(tasks) <= 1:
+        return {name: task() for name, task in tasks.items()}
+
+    executor = get_executor()
+    futures = {name: executor.submit(task) for name, task in tasks.items()}
+    done, pending = wait(futures.values(), timeout=timeout)
+    if pending:
+        wait([f for f in pending if not f.cancel()])
+        raise TimeoutError(
+            'Tasks {} did not finish in {} seconds'.format(
+                sorted(k for k, f in futures.items() if f in pending),
+                timeout))
+    return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,69 @@
+from sqlalchemy.orm import joinedload, selectinload, subqueryload
+
+from pg.exceptions import InvalidQueryError
+
+
+SELECTIN = 'selectin'
+JOINED = 'joined'
+SUBQUERY = 'subquery'
+
+STRATEGIES = {
+    SELECTIN: selectinload,
+    JOINED: joinedload,
+    SUBQUERY: subqueryload,
+}
+
+
+def default_strategy(relationship):
+    """
+    Many to one relationships are joined, a single extra column set per
+    row. Collections are loaded with one SELECT ... WHERE IN per level so
+    parent rows are not multiplied by the join
+    """
+    return SELECTIN if relationship.uselist else JOINED
+
+
+def prefetch_options(model, prefetch):
+    """
+    Translates relationship paths into loader options. prefetch is a list
+    of dotted paths, e.g. ['albums', 'artist.albums'], or a dictionary
+    {path: strategy} where strategy is 'selectin', 'joined', 'subquery'
+    or None for the default of each relationship. The strategy applies to
+    the last relationship of a path
+    """
+    if not prefetch:
+        return []
+    if isinstance(prefetch, str):
+        prefetch = [prefetch]
+    if not isinstance(prefetch, dict):
+        prefetch = {path: None for path in prefetch}
+
+    options = []
+    for path, strategy in prefetch.items():
+        if strategy is not None and strategy not in STRATEGIES:
+            raise InvalidQueryError(
+                'Unknown prefetch strategy {}'.format(strategy))
+
+        names = path.split('.')
+        mapper = model.__mapper__
+        option = None
+        for position, name in enumerate(names):
+            relationship = mapper.relationships.get(name)
+            if relationship is None:
+                raise InvalidQueryError(
+                    'Can not prefetch {}, {} has no relationship {}'.format(
+                        path, mapper.class_.__name__, name))
+
+            last = position == len(names) - 1
+            loader = STRATEGIES[
+                strategy if last and strategy is not None
+                else default_strategy(relationship)]
+            attribute = getattr(mapper.class_, name)
+            if option is None:
+                option = loader(attribute)
+            else:
+                # loader options are chained with methods of the same name
+                option = getattr(option, loader.__name__)(attribute)
+            mapper = relationship.mapper
+        options.append(option)
+    return options
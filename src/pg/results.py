@@ -0,0 +1,69 @@
+from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
+
+
+class Results(object):
+    """
+    Returned by BaseManager.filter_by whether the rows come from the
+    database, from the result cache or from the merge of several shards.
+    It has the read interface of a Query: iteration, indexing, slicing,
+    all, first, one, one_or_none and count (plus len). The rows are loaded
+    once, the first time all of them are needed; until then first, count
+    and slicing are sent to the database as the Query does. Other Query
+    methods (options, with_for_update, ...) are those of the query behind
+    the results, rows merged from several shards have no query
+    """
+    def __init__(self, query=None, rows=None):
+        self.query = query
+        self._rows = rows
+
+    def _load(self):
+        if self._rows is None:
+            self._rows = self.query.all()
+        return self._rows
+
+    def all(self):
+        return list(self._load())
+
+    def first(self):
+        if self._rows is None:
+            return self.query.first()
+        return self._rows[0] if self._rows else None
+
+    def one_or_none(self):
+        if self._rows is None:
+            return self.query.one_or_none()
+        if len(self._rows) > 1:
+            raise MultipleResultsFound(
+                'Multiple rows were found when one or none was required')
+        return self._rows[0] if self._rows else None
+
+    def one(self):
+        if self._rows is None:
+            return self.query.one()
+        obj = self.one_or_none()
+        if obj is None:
+            raise NoResultFound('No row was found when one was required')
+        return obj
+
+    def count(self):
+        if self._rows is None:
+            return self.query.count()
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __getitem__(self, item):
+        if self._rows is None:
+            return self.query[item]
+        return self._rows[item]
+
+    def __len__(self):
+        return len(self._load())
+
+    def __getattr__(self, name):
+        query = self.__dict__.get('query')
+        if query is None:
+            raise AttributeError(
+                'Results merged from several shards have no {}'.format(name))
+        return getattr(query, name)
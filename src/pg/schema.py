@@ -22,6 +22,7 @@ Base.metadata.naming_convention = {
 class utcnow(functions.FunctionElement):
     key = 'utcnow'
     type = DateTime(timezone=True)
+    inherit_cache = True
 
 
 @compiles(utcnow)
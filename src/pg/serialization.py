@@ -0,0 +1,100 @@
+from operator import attrgetter
+
+from pg.types import Password
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(sorted(_freeze(v) for v in value))
+    return value
+
+
+class ModelSerializer(object):
+    """
+    Turns model instances, or raw row tuples, into JSON ready dictionaries.
+    The column list comes from the mapper and is resolved once, password
+    columns are left out unless they are listed in only.
+
+    only: column names to include
+    exclude: column names to leave out
+    nested: relationship names to include, either a list of names or a
+        dictionary {name: {'only': ..., 'exclude': ..., 'nested': ...}}
+    """
+    def __init__(self, model, only=None, exclude=None, nested=None):
+        self.model = model
+        mapper = model.__mapper__
+        only = set(only) if only is not None else None
+        exclude = set(exclude or ())
+
+        self.keys = tuple(
+            attr.key for attr in mapper.column_attrs
+            if attr.key not in exclude
+            and (only is None or attr.key in only)
+            and (only is not None or not isinstance(
+                attr.columns[0].type, Password))
+        )
+        self.columns = tuple(
+            getattr(model, key) for key in self.keys)
+        self._getter = attrgetter(*self.keys) if self.keys else None
+
+        if isinstance(nested, (list, tuple, set)):
+            nested = {name: None for name in nested}
+
+        self.nested = []
+        for name, options in (nested or {}).items():
+            relationship = mapper.relationships[name]
+            self.nested.append((
+                name, relationship.uselist,
+                get_serializer(relationship.mapper.class_, **(options or {}))
+            ))
+
+    def _values(self, obj):
+        if self._getter is None:
+            return ()
+        values = self._getter(obj)
+        return values if len(self.keys) > 1 else (values, )
+
+    def dump(self, obj):
+        if obj is None:
+            return None
+
+        data = dict(zip(self.keys, self._values(obj)))
+        for name, uselist, serializer in self.nested:
+            value = getattr(obj, name)
+            if uselist:
+                data[name] = serializer.dump_many(value)
+            else:
+                data[name] = serializer.dump(value)
+        return data
+
+    def dump_many(self, objs):
+        """
+        Serializes an iterable of instances, such as a query
+        """
+        return [self.dump(obj) for obj in objs]
+
+    def dump_rows(self, rows):
+        """
+        Serializes row tuples selected with the serializer columns, e.g.
+        session.query(*serializer.columns), without building ORM objects
+        """
+        keys = self.keys
+        return [dict(zip(keys, row)) for row in rows]
+
+
+_serializers = {}
+
+
+def get_serializer(model, only=None, exclude=None, nested=None):
+    """
+    Returns the cached serializer of a model for the given options
+    """
+    key = (model, _freeze(only), _freeze(exclude), _freeze(nested))
+    serializer = _serializers.get(key)
+    if serializer is None:
+        serializer = ModelSerializer(
+            model, only=only, exclude=exclude, nested=nested)
+        _serializers[key] = serializer
+    return serializer
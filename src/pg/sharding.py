@@ -0,0 +1,105 @@
+from operator import attrgetter
+
+from pg.exceptions import InvalidQueryError
+
+import heapq
+import itertools
+import zlib
+
+
+def crc32_shard(value, shards):
+    """
+    Default shard function, a stable hash of the shard key modulo the
+    number of shards. Python's hash() is salted per process so it can not
+    be used here
+    """
+    return shards[zlib.crc32(str(value).encode('utf-8')) % len(shards)]
+
+
+class Shards(object):
+    """
+    Horizontal partitioning of a model across connections, declared on
+    the model as __shards__:
+
+        class User(BaseModel):
+            __shards__ = Shards(
+                ('SQLALCHEMY_DEFAULT', 'SQLALCHEMY_DB2'), key='key')
+
+    names: connection names holding a partition of the table
+    key: attribute used to pick the shard of a row
+    function: callable(value, names) returning a connection name,
+        crc32_shard by default
+    timeout: seconds to wait for the queries sent to every shard
+    """
+    def __init__(self, names, key, function=crc32_shard, timeout=None):
+        if not names:
+            raise ValueError('At least one shard is required')
+        self.names = tuple(names)
+        self.key = key
+        self.function = function
+        self.timeout = timeout
+
+    def shard_for(self, value):
+        if value is None:
+            raise InvalidQueryError(
+                'Shard key {} can not be None'.format(self.key))
+        name = self.function(value, self.names)
+        if name not in self.names:
+            raise InvalidQueryError('Unknown shard {}'.format(name))
+        return name
+
+    def route(self, connection_name, kwargs):
+        """
+        Connection names a query has to visit, the given connection name,
+        the shard of the shard key when it is filtered on, or every shard
+        """
+        if connection_name is not None:
+            return (connection_name, )
+        if self.key in kwargs:
+            return (self.shard_for(kwargs[self.key]), )
+        return self.names
+
+    def route_object(self, obj, connection_name=None):
+        if connection_name is not None:
+            return connection_name
+        return self.shard_for(getattr(obj, self.key, None))
+
+    def partition(self, rows, value):
+        """
+        Groups rows by shard, returns {name: [(position, row), ...]} so
+        per shard results can be put back in input order
+        """
+        groups = {}
+        for position, row in enumerate(rows):
+            name = self.shard_for(value(row))
+            groups.setdefault(name, []).append((position, row))
+        return groups
+
+
+def sort_key(names):
+    """
+    Key of the attributes names, NULL goes after every value as it does in
+    postgres (NULLS LAST ascending, NULLS FIRST descending)
+    """
+    getter = attrgetter(*names)
+    if len(names) == 1:
+        return lambda obj: (getter(obj) is None, getter(obj))
+    return lambda obj: tuple((v is None, v) for v in getter(obj))
+
+
+def merge_sorted(results, keys):
+    """
+    Merges lists already sorted by keys, a list of (attribute name,
+    descending) pairs. Lists sorted in a single direction are merged
+    lazily, mixed directions fall back to stable sorts
+    """
+    directions = set(descending for name, descending in keys)
+    if len(directions) == 1:
+        return list(heapq.merge(
+            *results, key=sort_key([name for name, d in keys]),
+            reverse=directions.pop()))
+
+    items = list(itertools.chain.from_iterable(results))
+    for name, descending in reversed(keys):
+        items.sort(key=sort_key([name]), reverse=descending)
+    return items
@@ -0,0 +1,258 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from sqlalchemy.exc import DBAPIError
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+
+logger = logging.getLogger('pg.slowlog')
+
+# EXPLAIN ANALYZE runs the statement, only plain reads are analyzed and
+# they run in a READ ONLY transaction that is rolled back. Other
+# statements, and reads that write anyway (nextval, functions), get the
+# plan without running them
+_EXPLAINABLE = re.compile(r'^\s*SELECT\b', re.IGNORECASE)
+_LOCKING = re.compile(
+    r'\bFOR\s+(UPDATE|SHARE|NO\s+KEY\s+UPDATE|KEY\s+SHARE)\b', re.IGNORECASE)
+_EXPLAIN_ANALYZE = 'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) '
+_EXPLAIN = 'EXPLAIN (FORMAT JSON) '
+_READ_ONLY_TRANSACTION = '25006'
+
+# execution option of the connections that capture plans, their
+# statements are not recorded
+EXPLAIN_OPTION = 'pg_slowlog_explain'
+
+
+def parameters_shape(parameters):
+    """
+    Parameter names and types without their values
+    """
+    if isinstance(parameters, dict):
+        return {k: type(v).__name__ for k, v in parameters.items()}
+    elif isinstance(parameters, (list, tuple)):
+        return [type(v).__name__ for v in parameters]
+    return type(parameters).__name__
+
+
+def explainable(statement):
+    return bool(_EXPLAINABLE.match(statement)) \
+        and not _LOCKING.search(statement)
+
+
+class SlowQueryLog(object):
+    """
+    Bounded ring buffer of the statements slower than threshold_ms. Only
+    a sample_rate fraction of the slow statements is kept. With explain
+    the plan of sampled statements is captured on a separate connection
+    by a single background thread: a statement is explained once while
+    it is among the last size explained ones, and plans are dropped
+    when explain_queue of them are already waiting
+    """
+    def __init__(
+            self, threshold_ms=500, sample_rate=1.0, explain=False, size=100,
+            explain_queue=10, random=random.random):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.explain = explain
+        self.size = size
+        self.explain_queue = explain_queue
+        self._threshold = threshold_ms / 1000.0
+        self._random = random
+        self._entries = deque(maxlen=size)
+        self._explained = OrderedDict()
+        self._pending = set()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def record(
+            self, connection_name, engine, statement, parameters, elapsed,
+            executemany=False):
+        if elapsed < self._threshold or self._random() >= self.sample_rate:
+            return None
+
+        entry = {
+            'connection': connection_name,
+            'statement': statement,
+            'parameters': parameters_shape(parameters),
+            'executemany': executemany,
+            'duration_ms': round(elapsed * 1000, 3),
+            'timestamp': time.time(),
+            'plan': None,
+        }
+        with self._lock:
+            self._entries.append(entry)
+        logger.warning(
+            'Slow query on %s (%.1f ms): %s',
+            connection_name, elapsed * 1000, statement)
+
+        if self.explain and not executemany:
+            self._submit(entry, engine, statement, parameters)
+        return entry
+
+    def _submit(self, entry, engine, statement, parameters):
+        with self._lock:
+            if statement in self._explained:
+                self._explained.move_to_end(statement)
+                return None
+            if len(self._pending) >= self.explain_queue:
+                entry['plan_error'] = 'Dropped, too many plans pending'
+                return None
+            self._explained[statement] = True
+            if len(self._explained) > self.size:
+                self._explained.popitem(last=False)
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='pg-explain')
+            future = self._executor.submit(
+                self._explain, entry, engine, statement, parameters)
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def _explain(self, entry, engine, statement, parameters):
+        try:
+            with engine.connect().execution_options(
+                    **{EXPLAIN_OPTION: True}) as connection:
+                if explainable(statement):
+                    try:
+                        entry['plan'] = self._plan(
+                            connection, _EXPLAIN_ANALYZE + statement,
+                            parameters)
+                        entry['analyzed'] = True
+                        return
+                    except DBAPIError as e:
+                        if getattr(e.orig, 'pgcode', None) != \
+                                _READ_ONLY_TRANSACTION:
+                            raise
+                entry['plan'] = self._plan(
+                    connection, _EXPLAIN + statement, parameters)
+                entry['analyzed'] = False
+        except Exception as e:
+            entry['plan_error'] = str(e)
+
+    def _plan(self, connection, sql, parameters):
+        transaction = connection.begin()
+        try:
+            connection.exec_driver_sql('SET TRANSACTION READ ONLY')
+            return connection.exec_driver_sql(sql, parameters).scalar()
+        finally:
+            transaction.rollback()
+
+    def flush(self, timeout=None):
+        """
+        Waits for the plans that are still being captured
+        """
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending, timeout=timeout)
+
+    def entries(self):
+        """
+        Captured statements, newest first
+        """
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._explained.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+slow_log = None
+
+
+def configure(
+        threshold_ms=500, sample_rate=1.0, explain=False, size=100,
+        explain_queue=10):
+    """
+    Replaces the process wide slow query log fed by the engine events
+    """
+    global slow_log
+    slow_log = SlowQueryLog(
+        threshold_ms=threshold_ms, sample_rate=sample_rate, explain=explain,
+        size=size, explain_queue=explain_queue)
+    return slow_log
+
+
+def disable():
+    global slow_log
+    slow_log = None
+
+
+def configure_from_app(app):
+    """
+    Enabled by PG_SLOW_QUERY_MS, PG_SLOW_QUERY_SAMPLE_RATE,
+    PG_SLOW_QUERY_EXPLAIN, PG_SLOW_QUERY_EXPLAIN_QUEUE and
+    PG_SLOW_QUERY_LOG_SIZE configuration values
+    """
+    threshold_ms = app.config.get('PG_SLOW_QUERY_MS')
+    if threshold_ms in (None, ''):
+        return slow_log
+
+    threshold_ms = float(threshold_ms)
+    sample_rate = float(app.config.get('PG_SLOW_QUERY_SAMPLE_RATE', 1.0))
+    explain = str(app.config.get('PG_SLOW_QUERY_EXPLAIN', '')).lower() in (
+        '1', 'true', 'yes')
+    size = int(app.config.get('PG_SLOW_QUERY_LOG_SIZE', 100))
+    explain_queue = int(app.config.get('PG_SLOW_QUERY_EXPLAIN_QUEUE', 10))
+
+    if slow_log is not None and (
+            slow_log.threshold_ms, slow_log.sample_rate, slow_log.explain,
+            slow_log.size, slow_log.explain_queue) == (
+                threshold_ms, sample_rate, explain, size, explain_queue):
+        return slow_log
+    return configure(
+        threshold_ms=threshold_ms, sample_rate=sample_rate, explain=explain,
+        size=size, explain_queue=explain_queue)
+
+
+def get_slow_log():
+    return slow_log
+
+
+def main():
+    import urllib.request
+
+    parser = argparse.ArgumentParser(
+        description='Prints the slow query log of a running application')
+    parser.add_argument(
+        'url', nargs='?', default='http://localhost:5000/pg/slow-queries')
+    parser.add_argument(
+        '--plans', action='store_true', help='print the captured plans')
+    parser.add_argument(
+        '--token', default=os.environ.get('PG_HTTP_TOKEN'),
+        help='PG_HTTP_TOKEN of the application')
+    args = parser.parse_args()
+
+    req = urllib.request.Request(args.url)
+    if args.token:
+        req.add_header('Authorization', 'Bearer {}'.format(args.token))
+    with urllib.request.urlopen(req) as response:
+        entries = json.loads(response.read())['slow_queries']
+
+    for entry in entries:
+        print('{:>10.1f} ms  {}  {}'.format(
+            entry['duration_ms'], entry['connection'],
+            ' '.join(entry['statement'].split())))
+        if args.plans and entry.get('plan'):
+            print(json.dumps(entry['plan'], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+from sqlalchemy import bindparam
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+import threading
+
+
+LIMIT = 'pg_limit'
+OFFSET = 'pg_offset'
+
+
+class StatementCache(object):
+    """
+    Statements built once per (model, method, filter names, order by,
+    connection name) whose filter values, limit and offset are bound
+    parameters. The SQL text is the same on every call, SQLAlchemy's
+    compiled cache is hit without rebuilding the statement and asyncpg
+    reuses its server side prepared statement
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """
+        Returns the statement cached under key, build() makes it on a miss
+        """
+        try:
+            statement = self._data.get(key)
+        except TypeError:
+            # order_by given as a list
+            return build()
+        if statement is not None:
+            self.hits += 1
+            return statement
+
+        statement = build()
+        with self._lock:
+            self.misses += 1
+            if len(self._data) >= self.max_size:
+                # statements are added in order, the oldest goes first
+                del self._data[next(iter(self._data))]
+            self._data[key] = statement
+        return statement
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'max_size': self.max_size,
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+
+statement_cache = StatementCache()
+
+
+def filter_shape(model, kwargs):
+    """
+    Shape of filter_by keyword arguments, (name, is_null) pairs. None is
+    returned when a name is not a column (relationships, typos) or the
+    cache is disabled, those filters go through Query.filter_by
+    """
+    if not statement_cache.enabled:
+        return None
+    columns = model.__mapper__.column_attrs
+    if not all(name in columns for name in kwargs):
+        return None
+    return tuple(sorted((k, v is None) for k, v in kwargs.items()))
+
+
+def criteria(model, shape):
+    """
+    Where clauses of a filter shape, NULL values are compared with IS NULL
+    as Query.filter_by does
+    """
+    return [
+        getattr(model, name).is_(None) if is_null
+        else getattr(model, name) == bindparam(name)
+        for name, is_null in shape
+    ]
+
+
+def parameters(kwargs, **extra):
+    """
+    Values bound to the statement of a filter shape
+    """
+    values = {k: v for k, v in kwargs.items() if v is not None}
+    values.update(extra)
+    return values
+
+
+class Explain(Executable, ClauseElement):
+    """
+    EXPLAIN (FORMAT JSON) of a statement. It is executed as a regular
+    statement, so the bind processors of the column types (GUID,
+    Password) are applied to the parameters
+    """
+    inherit_cache = False
+
+    def __init__(self, statement, analyze=False):
+        self.statement = statement
+        self.analyze = analyze
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    return 'EXPLAIN ({}FORMAT JSON) {}'.format(
+        'ANALYZE, BUFFERS, ' if element.analyze else '',
+        compiler.process(element.statement, **kw))
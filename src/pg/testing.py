@@ -0,0 +1,256 @@
+from contextlib import contextmanager
+from sqlalchemy import event, inspect, text
+
+from pg import instrumentation
+from pg.connection import RoutingSession, database_map, registry
+from pg.instrumentation import collect
+
+import os
+import pytest
+import time
+
+
+TRANSACTION = 'transaction'
+TRUNCATE = 'truncate'
+NONE = 'none'
+
+# ds_test=ds_test_w1,ds2_test=ds2_test_w1, set by pg.testrunner
+DATABASES_VARIABLE = 'PG_TEST_DATABASES'
+
+_SAVEPOINTS = ('SAVEPOINT ', 'RELEASE SAVEPOINT ', 'ROLLBACK TO SAVEPOINT ')
+
+
+@contextmanager
+def assert_max_queries(limit, connection_name=None):
+    """
+    Fails when the block issues more than limit statements, on every
+    connection or only on connection_name:
+
+        with assert_max_queries(2):
+            Artist.objects.filter_by(prefetch=['albums'])[:]
+    """
+    with collect() as stats:
+        yield stats
+
+    if connection_name is None:
+        issued = stats.queries
+    else:
+        connection = stats.connections.get(connection_name)
+        issued = connection.queries if connection is not None else 0
+
+    if issued > limit:
+        raise AssertionError(
+            '{} queries issued, expected at most {}:\n{}'.format(
+                issued, limit, '\n'.join(
+                    '{}x {}'.format(count, statement)
+                    for statement, count in stats.statements.most_common())))
+
+
+def _tables(connection, metadata):
+    existing = set(inspect(connection).get_table_names())
+    return [
+        t for t in reversed(metadata.sorted_tables) if t.name in existing]
+
+
+def _metadata():
+    from pg.orm import BaseModel
+    return BaseModel.metadata
+
+
+def truncate_tables(engine, metadata=None):
+    """
+    Empties every table of the models with a single TRUNCATE ...
+    RESTART IDENTITY CASCADE statement
+    """
+    with engine.begin() as connection:
+        tables = _tables(connection, metadata or _metadata())
+        if tables:
+            quote = connection.dialect.identifier_preparer.quote
+            connection.execute(text(
+                'TRUNCATE {} RESTART IDENTITY CASCADE'.format(
+                    ', '.join(quote(t.name) for t in tables))))
+
+
+def delete_tables(engine, metadata=None):
+    """
+    What PGSqlAlchemy.cleandb does for one connection, returns the time it
+    took
+    """
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        for table in _tables(connection, metadata or _metadata()):
+            connection.execute(
+                text('delete from {} cascade;'.format(table.name)))
+    return time.perf_counter() - start
+
+
+# cleandb time of every database, measured the first time a test uses it
+cleandb_seconds = {}
+
+
+class DatabaseIsolation(object):
+    """
+    Keeps every test on an empty database without PGSqlAlchemy.cleandb,
+    which is skipped while the test has not used a session yet (only the
+    first cleandb of every database in the run is executed).
+
+    TRANSACTION: sessions are bound to one connection per engine held in
+        a transaction that is rolled back after the test. Sessions work
+        in a SAVEPOINT, commit releases it and a new one is started,
+        rollback goes back to it. The SAVEPOINT statements are not
+        recorded by pg.instrumentation, and CURRENT_TIMESTAMP does not
+        change during the test
+    TRUNCATE: for tests that write through other connections (threads,
+        asyncio, two phase commit), the tables are emptied after the test
+        with TRUNCATE ... RESTART IDENTITY
+    """
+    def __init__(self, mode=TRANSACTION):
+        self.mode = mode
+        self.touched = False
+        self.skipped = 0
+        self.overhead = 0.0
+        self.engines = {}
+        self._connections = {}
+        self._savepoints = {}
+
+    def cleandb(self, connections):
+        """
+        Called by PGSqlAlchemy.cleandb, returns False when the tables have
+        to be cleaned. The first cleandb of every database in the run is
+        executed, and timed
+        """
+        if self.touched:
+            return False
+        for name, conn in connections.items():
+            url = str(conn.engine.url)
+            if url not in cleandb_seconds:
+                cleandb_seconds[url] = delete_tables(conn.engine)
+            self.engines[conn.engine] = cleandb_seconds[url]
+        self.skipped += 1
+        return True
+
+    def bind(self, engine):
+        self.touched = True
+        if self.mode != TRANSACTION:
+            return engine
+
+        connection = self._connections.get(engine)
+        if connection is None:
+            start = time.perf_counter()
+            connection = self._connections[engine] = engine.connect()
+            connection.begin()
+            self._savepoints[engine] = connection.begin_nested()
+            self.overhead += time.perf_counter() - start
+        return connection
+
+    def restart(self, session, transaction):
+        """
+        Starts a new SAVEPOINT once a session committed or rolled back,
+        only the connections of the session are looked at, sessions of
+        other connections may be committing in other threads
+        """
+        engines = [session.bind]
+        if session.replicas is not None:
+            engines.extend(r.engine for r in session.replicas.replicas)
+        for engine in engines:
+            savepoint = self._savepoints.get(engine)
+            if savepoint is not None and not savepoint.is_active \
+                    and self._connections[engine].in_transaction():
+                self._savepoints[engine] = \
+                    self._connections[engine].begin_nested()
+
+    def ignores(self, connection, statement):
+        return statement.startswith(_SAVEPOINTS) and any(
+            connection is c for c in self._connections.values())
+
+    def install(self):
+        RoutingSession.isolation = self
+        instrumentation.ignore_statement = self.ignores
+        event.listen(RoutingSession, 'after_transaction_end', self.restart)
+
+    def uninstall(self):
+        event.remove(RoutingSession, 'after_transaction_end', self.restart)
+        instrumentation.ignore_statement = None
+        RoutingSession.isolation = None
+
+        start = time.perf_counter()
+        for connection in self._connections.values():
+            connection.close()
+        self._connections.clear()
+        self._savepoints.clear()
+
+        if self.mode == TRUNCATE and (self.touched or self.engines):
+            # writes of other connections are not seen by bind
+            for conn in list(registry.connections.values()):
+                truncate_tables(conn.engine)
+        self.overhead += time.perf_counter() - start
+
+    def saved(self):
+        """
+        Estimated seconds saved: the skipped cleandb calls minus the time
+        spent isolating the test
+        """
+        return self.skipped * sum(self.engines.values()) - self.overhead
+
+
+_reports = []
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        '--pg-isolation', choices=(TRANSACTION, TRUNCATE, NONE),
+        default=TRANSACTION,
+        help='how tests are kept on an empty database (pg.testing)')
+
+
+def parse_databases(value):
+    return dict(
+        pair.strip().split('=', 1) for pair in value.split(',')
+        if pair.strip())
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers',
+        'pg_truncate: the tables are truncated after the test instead of '
+        'rolling back its transaction')
+    # the connection strings of the tests are rewritten, they are
+    # declared in every test module
+    database_map.update(parse_databases(
+        os.environ.get(DATABASES_VARIABLE, '')))
+
+
+@pytest.fixture(autouse=True)
+def pg_isolation(request):
+    mode = request.config.getoption('--pg-isolation')
+    if mode == NONE:
+        yield None
+        return
+    if request.node.get_closest_marker('pg_truncate') is not None:
+        mode = TRUNCATE
+
+    isolation = DatabaseIsolation(mode)
+    isolation.install()
+    try:
+        yield isolation
+    finally:
+        isolation.uninstall()
+        if isolation.touched or isolation.engines:
+            _reports.append((request.node.nodeid, isolation))
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if not _reports:
+        return
+    write = terminalreporter.write_line
+    terminalreporter.section('pg isolation, estimated time saved')
+    total = 0.0
+    for nodeid, isolation in _reports:
+        saved = isolation.saved()
+        total += saved
+        write('{:>9.1f} ms  {:11}  {} cleandb skipped  {}'.format(
+            saved * 1000, isolation.mode, isolation.skipped, nodeid))
+    write('{:>9.1f} ms  total, cleandb took {}'.format(
+        total * 1000, ', '.join(
+            '{:.1f} ms on {}'.format(seconds * 1000, url.split('/')[-1])
+            for url, seconds in cleandb_seconds.items())))
@@ -0,0 +1,59 @@
+from pg import hashing
+from pg.calibrate import calibrate
+from pg.types import PasswordHash
+
+import asyncio
+import pytest
+
+
+@pytest.mark.parametrize('backend', ['inline', 'thread', 'process'])
+def test_hasher_backends(backend):
+    hasher = hashing.BcryptHasher(
+        backend=backend, max_workers=2, max_pending=4)
+    try:
+        hashed = hasher.hash('secret', 4)
+        assert hasher.verify('secret', hashed)
+        assert not hasher.verify('wrong', hashed)
+
+        futures = [hasher.verify_future('secret', hashed) for x in range(6)]
+        assert all(f.result() for f in futures)
+
+        assert asyncio.run(hasher.verify_async('secret', hashed))
+        assert asyncio.run(hasher.hash_async('secret', 4))
+
+        metrics = hasher.metrics()
+        assert backend == metrics['backend']
+        assert 0 == metrics['in_flight']
+        assert 0 == metrics['queue_depth']
+        assert 2 == metrics['hash']['count']
+        assert 9 == metrics['verify']['count']
+        assert metrics['verify']['max_seconds'] > 0
+    finally:
+        hasher.shutdown()
+
+
+def test_password_hash_uses_configured_hasher():
+    previous = hashing.get_hasher()
+    hasher = hashing.configure(backend='thread', max_workers=2)
+    try:
+        password = PasswordHash.new_future('secret', 4).result()
+        assert 4 == password.rounds
+        assert password == 'secret'
+        assert password != 'wrong'
+        assert password.verify_future('secret').result()
+        assert 1 == hasher.metrics()['hash']['count']
+        assert 3 == hasher.metrics()['verify']['count']
+    finally:
+        hashing.configure(backend=previous.backend)
+
+
+def test_calibrate():
+    recommended, timings = calibrate(
+        target_ms=10000, min_rounds=4, max_rounds=6, samples=1)
+    assert 6 == recommended
+    assert [4, 5, 6] == list(timings)
+
+    recommended, timings = calibrate(
+        target_ms=0, min_rounds=4, max_rounds=6, samples=1)
+    assert 4 == recommended
+    assert [4] == list(timings)
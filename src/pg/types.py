@@ -1,16 +1,18 @@
+from concurrent.futures import Future
 from sqlalchemy import Text
 from sqlalchemy.types import TypeDecorator, CHAR
 from sqlalchemy.dialects.postgresql import UUID
 
+from pg import hashing
+
 import uuid
-import bcrypt
 
 
 class PasswordHash(object):
     """
     http://variable-scope.com/posts/storing-and-verifying-passwords-with-sqlalchemy
     """
-    def __init__(self, hash_):
+    def __init__(self, hash_, desired_rounds=None):
         assert len(hash_) == 60, 'bcrypt hash should be 60 chars.'
 
         if isinstance(hash_, bytes):
@@ -20,21 +22,24 @@ class PasswordHash(object):
 
         assert self.hash.count('$'), 'bcrypt hash should have 3x "$".'
         self.rounds = int(self.hash.split('$')[2])
+        self.desired_rounds = desired_rounds
+
+    @property
+    def needs_rehash(self):
+        """True when the hash cost differs from the column configured cost."""
+        return self.desired_rounds is not None and \
+            self.rounds != self.desired_rounds
 
     def __eq__(self, candidate):
         """Hashes the candidate string and compares it to the stored hash."""
-        if isinstance(self.hash, str):
-            _hash = self.hash.encode('utf-8')
-        else:
-            _hash = self.hash
+        return self.verify_future(candidate).result()
 
+    def verify_future(self, candidate):
+        """Checks the candidate on the bcrypt hasher, returns a future."""
         if isinstance(candidate, PasswordHash):
             candidate = candidate.hash
 
-        if isinstance(candidate, str):
-            candidate = candidate.encode('utf-8')
-
-        return bcrypt.hashpw(candidate, _hash) == _hash
+        return hashing.get_hasher().verify_future(candidate, self.hash)
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -46,10 +51,22 @@ class PasswordHash(object):
     @classmethod
     def new(cls, password, rounds):
         """Creates a PasswordHash from the given password."""
-        if isinstance(password, str):
-            password = password.encode('utf8')
-        value = bcrypt.hashpw(password, bcrypt.gensalt(rounds))
-        return cls(value)
+        return cls(hashing.get_hasher().hash(password, rounds))
+
+    @classmethod
+    def new_future(cls, password, rounds):
+        """Hashes the password on the bcrypt hasher, returns a future."""
+        future = Future()
+        hashed = hashing.get_hasher().hash_future(password, rounds)
+
+        def done(f):
+            try:
+                future.set_result(cls(f.result()))
+            except Exception as e:
+                future.set_exception(e)
+
+        hashed.add_done_callback(done)
+        return future
 
 
 class Password(TypeDecorator):
@@ -67,7 +84,7 @@ class Password(TypeDecorator):
     def process_result_value(self, value, dialect):
         """Convert the hash to a PasswordHash, if it's non-NULL."""
         if value is not None:
-            return PasswordHash(value)
+            return PasswordHash(value, desired_rounds=self.rounds)
 
     def validator(self, password):
         """Provides a validator/converter for @validates usage."""
@@ -1,13 +1,58 @@
 from datetime import date, datetime
 from decimal import Decimal
 from flask import json
-from jsonschema import validate, FormatChecker
-from jsonschema.exceptions import ValidationError
+from serializers import encoders
 
 import typing
 import uuid
 
 
+def _native_format(
+        checker_class, name: str, native_check: typing.Callable):
+    """
+    Wraps the default jsonschema format check so python objects are
+    validated natively and strings keep the default behaviour
+    """
+    default = checker_class.checkers.get(name)
+
+    def check(instance) -> bool:
+        if isinstance(instance, str):
+            return default is None or default[0](instance)
+        elif isinstance(instance, (uuid.UUID, date)):
+            return native_check(instance)
+        return True
+
+    return check, default[1] if default else ()
+
+
+def _is_string(checker, instance) -> bool:
+    # uuid, date and datetime values are serialized as strings
+    return isinstance(instance, (str, uuid.UUID, date, datetime))
+
+
+_format_checker = None
+
+
+def get_format_checker():
+    """
+    jsonschema is imported, and the format checker built, the first time
+    a schema is validated so importing serializers stays cheap
+    """
+    global _format_checker
+    if _format_checker is None:
+        from jsonschema import FormatChecker
+
+        checker = FormatChecker()
+        for name, native_check in (
+                ('uuid', lambda o: isinstance(o, uuid.UUID)),
+                ('date', lambda o: type(o) == date),
+                ('date-time', lambda o: isinstance(o, datetime))):
+            check, raises = _native_format(FormatChecker, name, native_check)
+            checker.checks(name, raises=raises)(check)
+        _format_checker = checker
+    return _format_checker
+
+
 class SerializerError(Exception):
     """
     This exception should be thrown if serializer errors happen
@@ -24,8 +69,6 @@ class JsonSerializer(object):
 
     _payload: str = None
 
-    _data_to_validate: typing.Dict = {}
-
     _properties: typing.Dict = {}
 
     def __init__(self, payload: str = None, data: typing.Dict = None):
@@ -46,45 +89,36 @@ class JsonSerializer(object):
                 'Can not build a serializer without'
                 'a data dictionary or string payload associated')
 
-    def custom_converter(
-            self, o: typing.Union[uuid.UUID, date, datetime]) -> str:
-        if type(o) == uuid.UUID:
-            return str(o)
-        elif type(o) == date:
-            return o.isoformat()
-        elif type(o) == datetime:
-            return o.astimezone().isoformat()
+    @classmethod
+    def get_validator(cls):
+        """
+        Returns the validator of the serializer schema, it is built and the
+        schema checked only once per serializer class
+        """
+        validator = cls.__dict__.get('_validator')
+        if validator is None or validator.schema is not cls._schema:
+            from jsonschema import validators
+
+            schema = cls._schema
+            validator_class = validators.validator_for(schema)
+            validator_class.check_schema(schema)
+            validator_class = validators.extend(
+                validator_class,
+                type_checker=validator_class.TYPE_CHECKER.redefine(
+                    'string', _is_string))
+            validator = validator_class(
+                schema, format_checker=get_format_checker())
+            cls._validator = validator
+        return validator
 
     def validate(self) -> None:
-        # avoid extra values not defined in the schema
-        if 'additionalProperties' not in self._schema:
-            self._schema['additionalProperties'] = True
-
-        try:
-            validate(
-                self._data_to_validate, self._schema,
-                format_checker=FormatChecker())
-        except ValidationError as e:
-            instances = (
-                uuid.UUID, date, datetime
-            )
-            if type(e.instance) in instances:
-                # jsonchema can not deal with uuid validation
-                # so string conversion is a way to handle this
-                self._data_to_validate = json.loads(
-                    self.dumps(), parse_float=Decimal)
-            validate(
-                self._data_to_validate, self._schema,
-                format_checker=FormatChecker())
-        finally:
-            self._data_to_validate = None
+        self.get_validator().validate(self._data)
 
     def initialize(self, data: typing.Dict) -> None:
         """
         Loads serializer from a request object
         """
         self._data = data
-        self._data_to_validate = self._data.copy()
         self.validate()
 
     @property
@@ -98,6 +132,6 @@ class JsonSerializer(object):
     def payload(self) -> str:
         return self.dumps()
 
-    def dumps(self, indent: int = 4):
-        return json.dumps(
-            self._data, default=self.custom_converter, indent=indent)
+    def dumps(self, indent: int = None) -> str:
+        return encoders.dumps(
+            self._data, indent=indent, sort_keys=encoders.app_sort_keys())
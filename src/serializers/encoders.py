@@ -0,0 +1,135 @@
+from datetime import date, datetime
+from decimal import Decimal
+from flask import current_app
+
+import json
+import typing
+import uuid
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class StdlibBackend(object):
+    """
+    Standard library encoder, non native values go through default().
+    Non ASCII characters are written as UTF-8, as orjson does
+    """
+    name = 'stdlib'
+
+    class Encoder(json.JSONEncoder):
+        def default(self, o):
+            if isinstance(o, (datetime, date)):
+                return o.isoformat()
+            elif isinstance(o, uuid.UUID):
+                return str(o)
+            elif isinstance(o, Decimal):
+                # a float would lose precision
+                return str(o)
+            return super().default(o)
+
+    _compact = Encoder(separators=(',', ':'), ensure_ascii=False)
+    _sorted = Encoder(
+        separators=(',', ':'), ensure_ascii=False, sort_keys=True)
+
+    def dumps(
+            self, data: typing.Any, indent: int = None,
+            sort_keys: bool = False) -> str:
+        if indent:
+            return json.dumps(
+                data, cls=self.Encoder, indent=indent, ensure_ascii=False,
+                sort_keys=sort_keys)
+        if sort_keys:
+            return self._sorted.encode(data)
+        return self._compact.encode(data)
+
+    def dumpb(
+            self, data: typing.Any, indent: int = None,
+            sort_keys: bool = False) -> bytes:
+        return self.dumps(
+            data, indent=indent, sort_keys=sort_keys).encode('utf-8')
+
+
+class OrjsonBackend(object):
+    """
+    C accelerated encoder, uuid, date and datetime values are serialized
+    natively, only Decimal values need a python callback. orjson only
+    indents with 2 spaces, other indents go through the stdlib encoder
+    """
+    name = 'orjson'
+
+    _stdlib = StdlibBackend()
+
+    @staticmethod
+    def _default(o):
+        if isinstance(o, Decimal):
+            return str(o)
+        raise TypeError
+
+    def dumpb(
+            self, data: typing.Any, indent: int = None,
+            sort_keys: bool = False) -> bytes:
+        if indent and indent != 2:
+            return self._stdlib.dumpb(
+                data, indent=indent, sort_keys=sort_keys)
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(data, default=self._default, option=option)
+
+    def dumps(
+            self, data: typing.Any, indent: int = None,
+            sort_keys: bool = False) -> str:
+        return self.dumpb(
+            data, indent=indent, sort_keys=sort_keys).decode('utf-8')
+
+
+BACKENDS = {
+    StdlibBackend.name: StdlibBackend,
+    OrjsonBackend.name: OrjsonBackend,
+}
+
+backend = OrjsonBackend() if orjson is not None else StdlibBackend()
+
+
+def set_backend(name: str):
+    """
+    Selects the encoder used by dumps and dumpb, 'orjson' or 'stdlib'
+    """
+    global backend
+    if name not in BACKENDS:
+        raise ValueError('Unknown json backend {}'.format(name))
+    if name == OrjsonBackend.name and orjson is None:
+        raise ValueError('orjson is not installed')
+    backend = BACKENDS[name]()
+    return backend
+
+
+def get_backend():
+    return backend
+
+
+def app_sort_keys() -> bool:
+    """
+    JSON_SORT_KEYS of the current application, flask.json sorts keys by
+    default
+    """
+    if current_app:
+        return current_app.config.get('JSON_SORT_KEYS', True)
+    return True
+
+
+def dumps(
+        data: typing.Any, indent: int = None,
+        sort_keys: bool = False) -> str:
+    return backend.dumps(data, indent=indent, sort_keys=sort_keys)
+
+
+def dumpb(
+        data: typing.Any, indent: int = None,
+        sort_keys: bool = False) -> bytes:
+    return backend.dumpb(data, indent=indent, sort_keys=sort_keys)
@@ -49,3 +49,19 @@ def test_app_config():
         assert 'AWS_SECRET' in app.config
         assert 'DB_USERNAME' in app.config
         assert 'PREFIX_NOT_EXISTS' not in app.config
+
+
+def test_app_config_prefixes_match_the_start():
+    """
+    Prefixes only match the beginning of the variable name
+    """
+    mock_env = {
+        'FLASK_CONFIG_PREFIXES': 'AWS',
+        'AWS_REGION': 'eu-west-1',
+        'MY_AWS_REGION': 'us-east-1',
+    }
+
+    with patch.dict(os.environ, mock_env):
+        app = get_or_create_app(__name__)
+        assert 'eu-west-1' == app.config['AWS_REGION']
+        assert 'MY_AWS_REGION' not in app.config
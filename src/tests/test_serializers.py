@@ -1,11 +1,16 @@
-from serializers import JsonSerializer, SerializerError
+from serializers import JsonSerializer, SerializerError, encoders
 from tests.base import BaseTestFactory
 
-from datetime import date, datetime
-from flask import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from flask import Flask, json
+from jsonschema import FormatChecker, validate
 from jsonschema.exceptions import ValidationError
+from users.serializers import SignUpSerializer
+from utils import json_response
 
 import pytest
+import time
 
 
 new_message_schema = {
@@ -78,8 +83,9 @@ def test_basic_json_serializer():
         serializer.payload = None
 
     assert data == serializer.data
-    payload = json.dumps(data, indent=4)
+    payload = json.dumps(data, separators=(',', ':'))
     assert payload == serializer.payload
+    assert json.dumps(data, indent=2) == serializer.dumps(indent=2)
 
 
 def test_serializer_uuid_date_datetime():
@@ -106,3 +112,119 @@ def test_serializer_uuid_date_datetime():
 
     serializer2 = Message(data=data)
     assert serializer2.data == data
+
+
+def test_validator_is_cached():
+    """
+    Tests that validators are built once per class and the class schema
+    is never modified
+    """
+    schema = dict(message_schema)
+    validator = Message.get_validator()
+    assert validator is Message.get_validator()
+    assert validator is not NewMessage.get_validator()
+    assert schema == Message._schema
+
+    data = {
+        'title': BaseTestFactory.create_random_string(),
+        'body': BaseTestFactory.create_random_string(),
+        'date': date.today(),
+        'date-time': datetime.utcnow(),
+        'key': BaseTestFactory.create_random_uuid()
+    }
+    Message(data=data)
+    assert validator is Message.get_validator()
+
+    with pytest.raises(ValidationError):
+        Message(data=dict(data, key='not-a-uuid'))
+
+    with pytest.raises(ValidationError):
+        Message(data=dict(data, date=datetime.utcnow()))
+
+
+def test_signup_serializer_benchmark():
+    """
+    Micro benchmark, the cached validator against jsonschema.validate that
+    checks the schema and builds a validator on every call
+    """
+    pwd = BaseTestFactory.create_random_string()
+    data = {
+        'username': BaseTestFactory.create_random_email(),
+        'password': pwd,
+        'password2': pwd,
+    }
+    n = 500
+
+    start = time.perf_counter()
+    for x in range(n):
+        validate(
+            data, SignUpSerializer._schema, format_checker=FormatChecker())
+    uncached = (time.perf_counter() - start) / n
+
+    SignUpSerializer(data=data)
+    start = time.perf_counter()
+    for x in range(n):
+        SignUpSerializer(data=data)
+    cached = (time.perf_counter() - start) / n
+
+    print('\nSignUpSerializer: {:.1f} us/call, jsonschema.validate: '
+          '{:.1f} us/call'.format(cached * 1e6, uncached * 1e6))
+    assert cached < uncached
+
+
+@pytest.mark.parametrize('backend', sorted(encoders.BACKENDS))
+def test_json_backends(backend):
+    previous = encoders.get_backend()
+    try:
+        encoders.set_backend(backend)
+        key = BaseTestFactory.create_random_uuid()
+        data = {
+            'key': key,
+            'date': date(2019, 5, 1),
+            'date-time': datetime(2019, 5, 1, 10, 30, tzinfo=timezone.utc),
+            'amount': Decimal('12345678901234567.10'),
+            'items': [1, 'two', None, True]
+        }
+        # Decimal values are strings, a float would lose precision
+        assert (
+            '{{"key":"{}","date":"2019-05-01",'
+            '"date-time":"2019-05-01T10:30:00+00:00",'
+            '"amount":"12345678901234567.10",'
+            '"items":[1,"two",null,true]}}'.format(key)
+        ) == encoders.dumps(data)
+        assert encoders.dumps(data).encode('utf-8') == encoders.dumpb(data)
+
+        # every backend gives the same output as the stdlib encoder
+        stdlib = encoders.StdlibBackend()
+        for indent in (None, 2, 4):
+            assert stdlib.dumps(data, indent=indent) == encoders.dumps(
+                data, indent=indent)
+        assert '{\n    "a": 1\n}' == encoders.dumps({'a': 1}, indent=4)
+        assert '{"a":1,"b":2}' == encoders.dumps(
+            {'b': 2, 'a': 1}, sort_keys=True)
+
+        # non ASCII characters are written as UTF-8, not escaped
+        assert '{"name":"Dublín"}' == encoders.dumps({'name': 'Dublín'})
+        # datetimes are written as they are, naive ones without offset
+        assert '"2019-05-01T10:30:00"' == encoders.dumps(
+            datetime(2019, 5, 1, 10, 30))
+    finally:
+        encoders.set_backend(previous.name)
+
+
+def test_json_sort_keys():
+    """
+    json_response and JsonSerializer.dumps sort keys as flask.json does,
+    unless JSON_SORT_KEYS is disabled
+    """
+    data = {'message': 'm', 'code': 400}
+    assert '{"code":400,"message":"m"}' == Error(data=data).dumps()
+
+    app = Flask(__name__)
+    with app.app_context():
+        assert b'{"code":400,"message":"m"}' == json_response(
+            data=data).get_data()
+        app.config['JSON_SORT_KEYS'] = False
+        assert b'{"message":"m","code":400}' == json_response(
+            data=data).get_data()
+        assert '{"message":"m","code":400}' == Error(data=data).dumps()
@@ -0,0 +1,43 @@
+from flask import Flask, json
+from utils import stream_json_response
+
+
+def create_app():
+    app = Flask(__name__)
+
+    @app.route('/items')
+    def items():
+        return stream_json_response(
+            ({'id': x} for x in range(7)), chunk_size=3)
+
+    @app.route('/items.ndjson')
+    def items_ndjson():
+        return stream_json_response(
+            range(7), ndjson=True, chunk_size=3,
+            serialize=lambda x: {'id': x})
+
+    @app.route('/empty')
+    def empty():
+        return stream_json_response([])
+
+    return app
+
+
+def test_stream_json_response():
+    app = create_app()
+
+    with app.test_client() as c:
+        result = c.get('/items')
+        assert 200 == result.status_code
+        assert 'application/json' == result.mimetype
+        assert [{'id': x} for x in range(7)] == json.loads(
+            result.get_data().decode('utf-8'))
+
+        result = c.get('/items.ndjson')
+        assert 'application/x-ndjson' == result.mimetype
+        lines = result.get_data().decode('utf-8').splitlines()
+        assert [{'id': x} for x in range(7)] == [
+            json.loads(line) for line in lines]
+
+        result = c.get('/empty')
+        assert [] == json.loads(result.get_data().decode('utf-8'))
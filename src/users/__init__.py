@@ -1,5 +1,4 @@
-from .blueprint import users_bp
-
-
 def config_users(app):
+    # imported here so the models can be used without the oauth app
+    from .blueprint import users_bp
     app.register_blueprint(users_bp, url_prefix='/users')
@@ -3,6 +3,7 @@ from flask import request, json, Response, current_app
 from flask import _app_ctx_stack
 from jsonschema.exceptions import ValidationError
 from utils import json_response
+from pg.types import PasswordHash
 from .pg_models import User
 from .serializers import SignUpSerializer
 from oauth import create_user as create_oauth_user
@@ -23,6 +24,10 @@ def signup() -> Response:
         serializer = SignUpSerializer(data=request.json)
         data = serializer.data
         del data['password2']
+        # bcrypt runs on the configured hasher (BCRYPT_BACKEND), the
+        # request waits for it
+        data['password'] = PasswordHash.new(
+            data['password'], User.password.type.rounds)
         data['key'] = str(uuid.uuid4())
         obj = User(**data)
         obj.add()
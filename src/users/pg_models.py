@@ -1,5 +1,5 @@
 from pg.orm import BaseModel
-from pg.types import Password
+from pg.types import Password, PasswordHash
 
 from sqlalchemy import Column, String
 from sqlalchemy.dialects.postgresql import UUID
@@ -15,7 +15,19 @@ class User(BaseModel):
         return self.key
 
     @classmethod
-    def check_password(cls, username=None, password=None):
+    def check_password(cls, username=None, password=None, rehash=True):
         user = cls.objects.get(username=username)
-        assert user.password == password
+        # the comparison runs on the configured bcrypt hasher pool
+        assert user.password.verify_future(password).result()
+        if rehash and user.password.needs_rehash:
+            user.rehash_password(password)
         return user
+
+    def rehash_password(self, password):
+        """
+        Stores the password again with the cost configured in the column,
+        called after a successful verification. The new hash is flushed,
+        it is committed with the rest of the request
+        """
+        self.password = PasswordHash.new(password, User.password.type.rounds)
+        self.update()
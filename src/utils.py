@@ -1,5 +1,7 @@
-from flask import json, Response, current_app, _app_ctx_stack
+from flask import Response, current_app, _app_ctx_stack
+from flask import stream_with_context
 from flask.views import MethodView
+from serializers import encoders
 
 import typing
 
@@ -9,7 +11,52 @@ def json_response(
         headers: typing.Dict = {},
         mimetype: str = 'application/json') -> Response:
     return Response(
-        json.dumps(data), status=status, mimetype=mimetype, headers=headers)
+        encoders.dumpb(data, sort_keys=encoders.app_sort_keys()),
+        status=status, mimetype=mimetype, headers=headers)
+
+
+def stream_json_response(
+        items: typing.Iterable, status: int = 200,
+        headers: typing.Dict = {}, ndjson: bool = False,
+        chunk_size: int = 500,
+        serialize: typing.Callable = None) -> Response:
+    """
+    Writes items as a JSON array, or as newline delimited JSON, chunk by
+    chunk so large results never live in memory as a single string
+    """
+    sort_keys = encoders.app_sort_keys()
+
+    def generate():
+        if not ndjson:
+            yield '['
+        separator = '\n' if ndjson else ','
+        first = True
+        chunk = []
+        for item in items:
+            if serialize is not None:
+                item = serialize(item)
+            encoded = encoders.dumps(item, sort_keys=sort_keys)
+            if ndjson:
+                chunk.append(encoded + separator)
+            elif first:
+                chunk.append(encoded)
+                first = False
+            else:
+                chunk.append(separator + encoded)
+
+            if len(chunk) >= chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+
+        if chunk:
+            yield ''.join(chunk)
+        if not ndjson:
+            yield ']'
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(
+        stream_with_context(generate()), status=status, mimetype=mimetype,
+        headers=headers)
 
 
 class BaseResourceView(MethodView):
@@ -6,6 +6,7 @@ sleep 2
 /usr/bin/psql -c "ALTER ROLE ds WITH ENCRYPTED PASSWORD 'dsps'";
 /usr/bin/psql -c "ALTER ROLE ds SET client_encoding TO 'utf8';"
 /usr/bin/psql -c "ALTER ROLE ds  WITH LOGIN;"
+/usr/bin/psql -c "ALTER ROLE ds  WITH CREATEDB;"
 /usr/bin/psql -c "ALTER ROLE ds SET default_transaction_isolation TO 'read committed';"
 /usr/bin/psql -c "ALTER ROLE ds SET timezone TO 'UTC';"
 /usr/bin/psql -c "CREATE DATABASE ds;"